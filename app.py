@@ -2,14 +2,19 @@ from flask import Flask, Response, jsonify, request, session, make_response, sen
 from flask_cors import CORS
 from flask_session import Session
 import networkx as nx
-from networkx.readwrite import json_graph
-import json, os, time, random, fitz, logging, sys, io, csv
-from copy import deepcopy
+import json, os, re, time, fitz, logging, sys, io, csv, hashlib, pickle, tempfile, uuid
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from io import BytesIO
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from difflib import SequenceMatcher
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from werkzeug.datastructures import FileStorage
+import threading
+import multiprocessing
+from pdf_pages import pdf_page_texts
+from solver import CHECK_TAGS, SolveProfile, UnionFind, index_slot_tokens, slot_tokens, solve_region, solve_region_task
 
 # Used for waitress deploy
 # logging.basicConfig(
@@ -43,6 +48,8 @@ app.config.update(
     SESSION_TYPE="filesystem",
     SESSION_FILE_DIR=SESSION_DIR,
     SESSION_PERMANENT=True,
+    # Only write the session file when a request changed the quote's inputs
+    SESSION_REFRESH_EACH_REQUEST=False,
     PERMANENT_SESSION_LIFETIME=60 * 60 * 24 * 30,  # 30 days
     SESSION_COOKIE_SAMESITE="Lax",
     SESSION_COOKIE_SECURE=False,
@@ -80,77 +87,241 @@ def require_auth():
     # Allow login and static file routes (adjust if necessary)
     if request.path == '/api/login' or request.path.startswith('/static'):
         return
+    # Scrapers have no session, so METRICS_TOKEN protects the metrics instead
+    # when it is set; without it they need a login like every other endpoint
+    if request.path == '/api/metrics' and os.environ.get("METRICS_TOKEN"):
+        return
     if request.path.startswith('/api/'):
         if not session.get('authenticated'):
             return jsonify({"error": "Not authorized"}), 401
 
 CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": ["http://localhost:3000", "https://publicationexplorer.com","https://jbam.up.railway.app/"]}})
 Session(app)
-G = nx.DiGraph()
-part_db = []
 system_tags = []
 PREBUILT_FILE = 'prebuilds.xlsx'
+# Spreadsheets the catalog is parsed from, and where the parsed snapshot is kept
+CATALOG_SOURCES = ['JBAMdb.xlsx', 'productDB.xlsx', 'SystemTags.xlsx']
+CATALOG_CACHE_DIR = os.environ.get("CATALOG_CACHE_DIR", ".catalog_cache")
+CATALOG_SNAPSHOT_VERSION = 3  # bump whenever the parsed catalog layout changes
 
-# A tiny Union–Find (Disjoint‐Set) for part‐UIDs:
-class UnionFind:
-    def __init__(self):
-        self.parent = {}
-        self.rank = {}
-
-    def make_set(self, x):
-        if x not in self.parent:
-            self.parent[x] = x
-            self.rank[x] = 0
-
-    def find(self, x):
-        # path compression
-        if self.parent[x] != x:
-            self.parent[x] = self.find(self.parent[x])
-        return self.parent[x]
-
-    def union(self, x, y):
-        rootx = self.find(x)
-        rooty = self.find(y)
-        if rootx == rooty:
-            return False
-        # union by rank
-        if self.rank[rootx] < self.rank[rooty]:
-            self.parent[rootx] = rooty
-        elif self.rank[rootx] > self.rank[rooty]:
-            self.parent[rooty] = rootx
-        else:
-            self.parent[rooty] = rootx
-            self.rank[rootx] += 1
-        return True
+class PartCatalog:
+    """
+    The parts loaded from JBAMdb.xlsx, indexed for constant-time lookup.
+    Iterating the catalog yields the part dicts in spreadsheet order.
+    """
+    def __init__(self, parts=()):
+        self.parts = []
+        self.by_id = {}
+        self.by_tag = defaultdict(list)
+        self.by_salesforce_id = {}
+        # Digest of the source spreadsheets, set by load_catalog
+        self.version = None
+        # Problems found while parsing the spreadsheets
+        self.diagnostics = []
+        # (slot-name token, slot type) -> {(ID, Name)} of parts offering that slot
+        self.slot_index = defaultdict(set)
+        # ID -> the ghosts its AddParts spawn, see index_expansions
+        self.expansions = {}
+        for part in parts:
+            self.add(part)
+        self.index_slots()
+        self.index_expansions()
+
+    def add(self, part):
+        self.parts.append(part)
+        # The first row wins when a product code appears on several sheets
+        self.by_id.setdefault(part['ID'], part)
+        for tag in part['Tags']:
+            self.by_tag[tag].append(part)
+        if part.get('SalesforceID'):
+            self.by_salesforce_id.setdefault(part['SalesforceID'], part)
+
+    def index_slots(self):
+        # Slots only settle once aliases are resolved, so this runs after loading
+        self.slot_index = defaultdict(set)
+        for part in self.parts:
+            for slot in part['Slots']:
+                for token in slot_tokens(slot['Name']):
+                    self.slot_index[(token, slot['Type'])].add((part['ID'], part['Name']))
+
+    def index_expansions(self):
+        """
+        Flatten each part's AddPart closure into the list of ghosts it spawns,
+        parents before their own AddParts, as (uid prefix, uid suffix, template).
+        A ghost's uid is prefix + parent uid + suffix, e.g. ghost-ghost-7-0-2 for
+        the third AddPart of the first AddPart of line item 7. Parts missing from
+        the catalog get a NOT IN DB template; a part adding one of its own
+        ancestors is left out instead of recursing forever. Returns those problems.
+        """
+        self.expansions = {}
+        problems = []
+
+        def expand(part, path, ancestors, ghosts):
+            for idx, ghost_id in enumerate(part['AddPart'].split(',')):
+                ghost_path = path + (idx,)
+                template = self.get(ghost_id)
+                if template is None:
+                    problems.append(f"{part['ID']} adds {ghost_id}, which is not in the catalog")
+                    template = {'ID': ghost_id,
+                        'Name': ghost_id + ' - NOT IN DB',
+                        'Slots': [],
+                        'Alias': None,
+                        'AddPart': None,
+                        'Tags': []}
+                elif template['ID'] in ancestors:
+                    problems.append(f"AddPart cycle {' -> '.join(ancestors + [template['ID']])}")
+                    continue
+                ghosts.append(('ghost-' * len(ghost_path), ''.join(f'-{i}' for i in ghost_path), template))
+                if template.get('AddPart'):
+                    expand(template, ghost_path, ancestors + [template['ID']], ghosts)
+
+        for part in self.by_id.values():
+            if part.get('AddPart'):
+                ghosts = []
+                expand(part, (), [part['ID']], ghosts)
+                self.expansions[part['ID']] = ghosts
+        return list(dict.fromkeys(problems))
+
+    def compatible_parts(self, slot_name, slot_type):
+        """Parts with a slot of slot_type sharing any token with slot_name."""
+        matches = set()
+        for token in slot_tokens(slot_name):
+            matches |= self.slot_index.get((token, slot_type), set())
+        return matches
+
+    def get(self, part_id, default=None):
+        return self.by_id.get(str(part_id), default)
+
+    def with_tag(self, tag):
+        return self.by_tag.get(tag, [])
+
+    def by_salesforce(self, salesforce_id, default=None):
+        return self.by_salesforce_id.get(str(salesforce_id), default)
+
+    def __contains__(self, part_id):
+        return str(part_id) in self.by_id
+
+    def __iter__(self):
+        return iter(self.parts)
 
-def find(lst, key, value):
-    for i, dic in enumerate(lst):
-        if dic[key] == str(value):
-            return i
-    return -1
+    def __len__(self):
+        return len(self.parts)
+
+part_db = PartCatalog()
+
+class SystemRules:
+    """
+    The SystemTags.xlsx rules, compiled once per catalog load. Every tag a rule
+    names gets an integer ID, and each rule becomes (requires, condition tag
+    IDs, other tag ID, warning):
+    - Require warns when all condition tags are present but the other tag is not.
+    - Exclude warns when the condition tag and the other tag are both present.
+    """
+    def __init__(self, table=None):
+        self.tag_ids = {}
+        self.rules = []
+        if table is None:
+            return
+        for kind, condition1, condition2, warning in zip(table['Type'], table['Condition1'], table['Condition2'], table['Warning']):
+            if kind == 'Require':
+                conditions = tuple(self.tag_id(cond.strip()) for cond in str(condition1).split(','))
+            elif kind == 'Exclude':
+                conditions = (self.tag_id(condition1),)
+            else:
+                continue
+            self.rules.append((kind == 'Require', conditions, self.tag_id(condition2), warning))
+
+    def tag_id(self, tag):
+        return self.tag_ids.setdefault(tag, len(self.tag_ids))
+
+    def check(self, parts):
+        """
+        (warning, triggering part names) for every rule the active parts break,
+        in rule order. One pass collects which active parts carry each rule tag;
+        each rule is then a few set lookups.
+        """
+        holders = defaultdict(list)
+        for part in parts:
+            if part['active']:
+                for tag in part['Tags']:
+                    tag_id = self.tag_ids.get(tag)
+                    if tag_id is not None:
+                        holders[tag_id].append(part['Name'])
+        broken = []
+        for requires, conditions, other, warning in self.rules:
+            if requires:
+                if other not in holders and all(c in holders for c in conditions):
+                    triggers = [name for c in conditions for name in holders[c]]
+                    broken.append((warning, list(dict.fromkeys(triggers))))
+            elif conditions[0] in holders and other in holders:
+                broken.append((warning, list(dict.fromkeys(holders[conditions[0]] + holders[other]))))
+        return broken
+
+system_rules = SystemRules()
 
 def share_element(A,B):
     return bool(set(A) & set(B))
 
-def unique_ones(matrix):
-    row_count = np.sum(matrix, axis=1, keepdims=True)
-    col_count = np.sum(matrix, axis=0, keepdims=True)
-    mask = (matrix == 1) & ((row_count == 1) | (col_count == 1))
-    return mask.astype(int)
+SLOT_COLUMN = re.compile(r'slot([1-9]|[12][0-9]|30)')
+SLOT_BOUND = r'\s*[+-]?\d+\s*'
+
+def read_catalog_sheets(file):
+    """Read every sheet of the workbook in one pass into a single frame,
+    keeping each row's sheet name and spreadsheet row number."""
+    frames = [
+        frame.assign(_sheet=sheet, _row=frame.index + 2)
+        for sheet, frame in pd.read_excel(file, sheet_name=None).items()
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+def parse_slot_cells(df):
+    """
+    Melt the slot1..slot30 columns into one row per filled cell and classify
+    each cell as Alias, AddPart or a Name:Min:Max:Type slot, columnwise.
+    Returns the long table (indexed by the part's row in df, in slot order)
+    and a list of malformed cells with their sheet and row.
+    """
+    slot_columns = sorted((c for c in df.columns if SLOT_COLUMN.fullmatch(str(c))), key=lambda c: int(c[4:]))
+    cells = df[slot_columns].reset_index(names='part').melt(id_vars='part', var_name='column', value_name='cell')
+    cells = cells.dropna(subset=['cell'])
+    cells['order'] = cells['column'].str[4:].astype(int)
+    cells = cells.sort_values(['part', 'order'], kind='stable')
+
+    # Object dtype, so .str works even when no cell is text
+    text = cells['cell'].astype(object).where(cells['cell'].map(lambda v: isinstance(v, str)))
+    fields = text.str.split(':')
+    cells['kind'] = np.select(
+        [text.isna(), text.str.startswith('Alias', na=False), text.str.startswith('AddPart', na=False)],
+        ['malformed', 'alias', 'addpart'],
+        'slot',
+    )
+    cells['value'] = fields.str[-1]
+    cells['name'] = fields.str[0]
+    cells['min'] = fields.str[1]
+    cells['max'] = fields.str[2]
+    cells['type'] = np.where(fields.str[-1] == 'H', 'Host', 'Plug')
+    slots = cells['kind'] == 'slot'
+    bounds_ok = cells['min'].str.fullmatch(SLOT_BOUND, na=False) & cells['max'].str.fullmatch(SLOT_BOUND, na=False)
+    cells.loc[slots & ~bounds_ok, 'kind'] = 'malformed'
+
+    bad = cells[cells['kind'] == 'malformed']
+    errors = [
+        f"{sheet}!{column} row {row}: malformed slot {cell!r}"
+        for sheet, row, column, cell in zip(df.loc[bad['part'], '_sheet'], df.loc[bad['part'], '_row'], bad['column'], bad['cell'])
+    ]
+    slots = cells['kind'] == 'slot'
+    cells.loc[slots, 'min'] = cells.loc[slots, 'min'].str.strip().astype(int)
+    cells.loc[slots, 'max'] = cells.loc[slots, 'max'].str.strip().astype(int)
+    return cells, errors
 
 def build_partdb(file):
-    global part_db, system_tags
-    sheets = pd.ExcelFile(file).sheet_names
-    df = pd.DataFrame()
-    # Iterate through sheets and merge into df
-    for sheet in sheets:
-        df = pd.concat([df, pd.read_excel(file, sheet_name=sheet)])
+    global part_db, system_tags, system_rules
+    df = read_catalog_sheets(file)
 
     # Any item without a name is removed
     df = df.dropna(subset='Description')
-    df.reset_index(drop=True, inplace=True)
 
-    sf_db = pd.read_excel('productDB.xlsx')  # Salesforce export
+    sf_db = pd.read_excel('productDB.xlsx', usecols=['Product Code', 'Product2ID'])  # Salesforce export
     sf_codes = sf_db['Product Code'].astype(str).unique()
     sf_lookup = dict(
         zip(sf_db['Product Code'].astype(str), sf_db['Product2ID'].astype(str))
@@ -158,46 +329,46 @@ def build_partdb(file):
 
     # Filter JBAMdb based on Salesforce active products
     df = df[df['Product Code'].astype(str).isin(sf_codes) | df['Product Code'].astype(str).str.startswith('JBAM-')]
+    df = df.reset_index(drop=True)
+
+    cells, errors = parse_slot_cells(df)
+    for error in errors:
+        logger.warning(f"[CATALOG] {error}")
+    aliases = cells[cells['kind'] == 'alias'].groupby('part')['value'].last().to_dict()
+    add_parts = cells[cells['kind'] == 'addpart'].groupby('part')['value'].agg(','.join).to_dict()
+    slots_by_part = defaultdict(list)
+    slot_cells = cells[cells['kind'] == 'slot']
+    for part, name, slot_min, slot_max, slot_type in zip(
+            slot_cells['part'].tolist(), slot_cells['name'].tolist(), slot_cells['min'].tolist(),
+            slot_cells['max'].tolist(), slot_cells['type'].tolist()):
+        slots_by_part[part].append({
+            'Name': name,
+            'Min': int(slot_min),
+            'Max': int(slot_max),
+            'Type': slot_type
+        })
+
+    if 'Tags' in df.columns:
+        # Blank or numeric cells are no tags, and an all-blank column is not text at all
+        text = df['Tags'].astype(object).where(df['Tags'].map(lambda v: isinstance(v, str)))
+        tags = text.str.strip().str.split(',').tolist()
+    else:
+        tags = [None] * len(df)
+
     # Just for tracking
     empty_parts, defined_parts = 0,0
-    for _, row in df.iterrows():
-        part_id = str(row['Product Code'])
-        part_name = row['Description']
-        part_tags = row['Tags'].strip().split(',') if 'Tags' in df.columns and not pd.isna(row['Tags']) else []
-        part_alias = None
-        add_part = []
-        slot_list = []
-        for j in range(1, 31):
-            rowname = 'slot' + str(j)
-            if rowname in df.columns and not pd.isna(row[rowname]):
-                if row[rowname].startswith('Alias'):
-                    part_alias = row[rowname].split(':')[-1]
-                    continue
-                elif row[rowname].startswith('AddPart'):
-                    add_part.append(row[rowname].split(':')[-1])
-                    continue
-                else:
-                    # Uncomment below to debug failed partdb load
-                    #print(row[rowname])
-                    slot_fields = row[rowname].split(':')
-                    slot_name = slot_fields[0]
-                    slot_min = int(slot_fields[1])
-                    slot_max = int(slot_fields[2])
-                    slot_type = 'Host' if slot_fields[-1] == 'H' else 'Plug'
-                    slot_list.append({
-                        'Name': slot_name,
-                        'Min': slot_min,
-                        'Max': slot_max,
-                        'Type': slot_type
-                    })
-
-        part_db.append({
+    catalog = PartCatalog()
+    catalog.diagnostics = list(errors)
+    for i, (part_id, part_name, part_tags) in enumerate(zip(df['Product Code'].astype(str).tolist(), df['Description'].tolist(), tags)):
+        slot_list = slots_by_part.get(i, [])
+        part_alias = aliases.get(i)
+        catalog.add({
             'Name': part_name,
             'ID': part_id,
             'Slots': slot_list,
             'Alias': part_alias,
-            'AddPart': ','.join(add_part),
-            'Tags': part_tags,
+            'AddPart': add_parts.get(i, ''),
+            'Tags': part_tags if isinstance(part_tags, list) else [],
             'SalesforceID': sf_lookup.get(part_id, None),
         })
         if not slot_list and not part_alias and part_name:
@@ -206,21 +377,192 @@ def build_partdb(file):
             defined_parts += 1
 
     # Resolve aliases
-    for part in part_db:
+    for part in catalog:
         if part['Alias']:
-            alias_part = next((d for d in part_db if d['ID'] == part['Alias']), None)
+            alias_part = catalog.get(part['Alias'])
             if alias_part:
                 part['Slots'] = part['Slots'] + alias_part['Slots']
                 part['AddPart'] = alias_part['AddPart']
             part['Alias'] = None
+    catalog.index_slots()
+    for problem in catalog.index_expansions():
+        logger.warning(f"[CATALOG] {problem}")
+        catalog.diagnostics.append(problem)
+    part_db = catalog
 
     # System tags
-    print('Defined parts: {}, undefined parts: {}'.format(str(defined_parts),str(empty_parts)))
+    print('Defined parts: {}, undefined parts: {}, malformed slot cells: {}'.format(str(defined_parts),str(empty_parts),str(len(errors))))
     system_tags = pd.read_excel('SystemTags.xlsx')
+    system_rules = SystemRules(system_tags)
+
+def source_stamps(paths):
+    """Size and modification time of each source file, for cheap change checks."""
+    stamps = {}
+    for path in paths:
+        stat = os.stat(path)
+        stamps[path] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+def source_hashes(paths):
+    hashes = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            hashes[path] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+def write_catalog_snapshot(snapshot_file, meta):
+    # Write beside the target and rename, so concurrent workers never read half a file
+    os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+    tmp_file = f"{snapshot_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Plain data only, so the snapshot loads whatever name this module runs under
+        data = {'parts': part_db.parts, 'diagnostics': part_db.diagnostics, 'version': part_db.version, 'system_tags': system_tags}
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, snapshot_file)
+
+def load_catalog(file):
+    """
+    Load part_db and system_tags, from the compiled snapshot when the source
+    spreadsheets are unchanged and by parsing them with build_partdb otherwise.
+    Sizes and mtimes are checked first; when they differ the files are hashed,
+    so a touched but identical file does not force a re-parse.
+    """
+    global part_db, system_tags, system_rules
+    # Cached solves belong to the catalog being replaced
+    solve_cache.clear()
+    sources = [file] + [path for path in CATALOG_SOURCES if path != file]
+    snapshot_file = os.path.join(CATALOG_CACHE_DIR, 'catalog.pickle')
+    stamps = source_stamps(sources)
+    hashes = None
+    try:
+        with open(snapshot_file, 'rb') as f:
+            meta = pickle.load(f)
+            if meta.get('format') == CATALOG_SNAPSHOT_VERSION and meta.get('sources') == sources:
+                fresh = meta['stamps'] == stamps
+                if not fresh:
+                    hashes = source_hashes(sources)
+                    fresh = meta['hashes'] == hashes
+                if fresh:
+                    data = pickle.load(f)
+                    catalog = PartCatalog(data['parts'])
+                    catalog.diagnostics = data['diagnostics']
+                    catalog.version = data['version']
+                    part_db = catalog
+                    system_tags = data['system_tags']
+                    system_rules = SystemRules(system_tags)
+                    if meta['stamps'] != stamps:
+                        meta['stamps'] = stamps
+                        write_catalog_snapshot(snapshot_file, meta)
+                    logger.info(f"[CATALOG] Loaded {len(part_db)} parts from snapshot {part_db.version[:12]}")
+                    return
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"[CATALOG] Ignoring unreadable snapshot {snapshot_file}: {e}")
 
-def extract_from_pdf(pdf_input):
+    build_partdb(file)
+    hashes = hashes or source_hashes(sources)
+    part_db.version = hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()
+    meta = {'format': CATALOG_SNAPSHOT_VERSION, 'sources': sources, 'stamps': stamps, 'hashes': hashes}
+    try:
+        write_catalog_snapshot(snapshot_file, meta)
+    except Exception as e:
+        logger.warning(f"[CATALOG] Could not write snapshot {snapshot_file}: {e}")
+    logger.info(f"[CATALOG] Parsed {len(part_db)} parts from {file}, snapshot {part_db.version[:12]}")
+
+# Quote PDFs: the line item table starts after this header and the terms after the terminator
+PDF_TABLE_HEADER = "QTY\nPRODUCT #"
+PDF_TERMINATOR = "E&I Cooperative Agreement"
+# Quotes with at least PDF_PARALLEL_PAGES pages are read by a pool of PDF_WORKERS
+# processes when PDF_WORKERS >= 2. The pool's processes come from a forkserver,
+# never forked from a threaded gunicorn worker, and run pdf_pages.pdf_page_texts
+# without importing app (except under `python app.py`, where app is __main__).
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", 0))
+PDF_PARALLEL_PAGES = int(os.environ.get("PDF_PARALLEL_PAGES", 8))
+PDF_PAGES_PER_TASK = 4
+PDF_CACHE_SIZE = int(os.environ.get("PDF_CACHE_SIZE", 128))
+pdf_pool = None
+pdf_rows_cache = OrderedDict()
+pdf_lock = threading.Lock()
+
+def iter_pdf_pages(file_bytes):
+    """
+    Yield the block texts of each page in order. Long documents are read by the
+    process pool in waves of consecutive pages, so a caller that stops early
+    leaves the later waves unread.
+    """
+    global pdf_pool
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        page_count = len(doc)
+        if PDF_WORKERS < 2 or page_count < PDF_PARALLEL_PAGES:
+            for page in doc:
+                yield [block[4] for block in page.get_text_blocks()]
+            return
+
+    with pdf_lock:
+        if pdf_pool is None:
+            pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    wave = PDF_WORKERS * PDF_PAGES_PER_TASK
+    for start in range(0, page_count, wave):
+        stop = min(start + wave, page_count)
+        tasks = [pdf_pool.submit(pdf_page_texts, file_bytes, range(first, min(first + PDF_PAGES_PER_TASK, stop)))
+                 for first in range(start, stop, PDF_PAGES_PER_TASK)]
+        for task in tasks:
+            yield from task.result()
+
+def read_quote_pdf(file_bytes):
+    """(quantity, item number, description) rows from a quote PDF's line item table."""
+    rows = []
+    for texts in iter_pdf_pages(file_bytes):
+        in_table = False
+        for text in texts:
+            if PDF_TERMINATOR in text:
+                return rows
+            if in_table:
+                tmp = [x for x in text.split("\n") if x.strip() != "*"]
+                if tmp and tmp[0].isnumeric():
+                    rows.append((int(tmp[0]), tmp[1], tmp[2]))
+            if PDF_TABLE_HEADER in text:
+                in_table = True
+    return rows
+
+def quote_pdf_rows(file_bytes):
+    """read_quote_pdf, cached by the hash of the file so re-uploads skip parsing."""
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    with pdf_lock:
+        if digest in pdf_rows_cache:
+            pdf_rows_cache.move_to_end(digest)
+            return pdf_rows_cache[digest]
+    rows = read_quote_pdf(file_bytes)
+    with pdf_lock:
+        pdf_rows_cache[digest] = rows
+        while len(pdf_rows_cache) > PDF_CACHE_SIZE:
+            pdf_rows_cache.popitem(last=False)
+    return rows
+
+def quote_line_items(quote, rows):
+    """
+    Expand (quantity, ID, description) rows into line items, taking new uids
+    from the quote's inputs (the session, or a plain dict offline).
+    """
+    parsed_items = []
+    for qty, item_id, desc in rows:
+        for _ in range(qty):
+            uid = quote["next_uid"]
+            quote["next_uid"] += 1
+            quote["active_status"][uid] = True
+            parsed_items.append({
+                "ID": item_id,
+                "Description": desc,
+                "active": True,
+                "uid": uid
+            })
+    return parsed_items
+
+def read_quote_file(pdf_input):
     """
-    Parse uploaded quote files.
+    Parse a quote file into (quantity, ID, description) rows.
     Supports: PDF and CSV (Excel removed).
     CSV must contain columns: Item ID, Description, Quantity
     """
@@ -230,10 +572,13 @@ def extract_from_pdf(pdf_input):
     # === CSV PARSE ===
     if ext == ".csv":
         pdf_input.seek(0)
+        # The delimiter sniffer needs text, and a plain bytes stream does not say it is binary
+        data = pdf_input.read()
+        text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
 
         # Infer delimiter (comma, tab, etc.)
         # engine='python' with sep=None lets pandas sniff the delimiter
-        df = pd.read_csv(pdf_input, sep=None, engine="python")
+        df = pd.read_csv(io.StringIO(text), sep=None, engine="python")
 
         # Normalize column names (strip spaces) then require the exact three
         df.columns = [str(c).strip() for c in df.columns]
@@ -250,25 +595,13 @@ def extract_from_pdf(pdf_input):
             .astype(int)
         )
 
-        parsed_items = []
-        for _, row in df.iterrows():
-            item_id = str(row["Item ID"]).strip()
-            desc = str(row["Description"])
-            qty = int(row["Quantity"])
-            for _ in range(qty):
-                uid = session["next_uid"]
-                session["next_uid"] += 1
-                session["active_status"][uid] = True
-                parsed_items.append({
-                    "ID": item_id,
-                    "Description": desc,
-                    "active": True,
-                    "uid": uid
-                })
-        return parsed_items
-
-    # === PDF PARSE === (unchanged)
-    data = []
+        return list(zip(
+            df["Quantity"].tolist(),
+            [str(x).strip() for x in df["Item ID"]],
+            [str(x) for x in df["Description"]],
+        ))
+
+    # === PDF PARSE ===
     if isinstance(pdf_input, str):
         with open(pdf_input, "rb") as f:
             file_bytes = f.read()
@@ -276,69 +609,27 @@ def extract_from_pdf(pdf_input):
         pdf_input.seek(0)
         file_bytes = pdf_input.read()
 
-    try:
-        logger.info(
-            f"[PDF_LOAD] Session {session.sid[-6:]} loaded PDF '{pdf_input.filename}' "
-            f"at {datetime.utcnow().isoformat(timespec='seconds')}"
-        )
-    except Exception:
-        pass
-
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    for page in doc:
-        startflag = False
-        text_blocks = page.get_text_blocks()
-        for block in text_blocks:
-            text = block[4]
-            if "E&I Cooperative Agreement" in text:
-                break
+    # Every quote gets a MISC node
+    return quote_pdf_rows(file_bytes) + [(1, "MISC", "N/A")]
 
-            if startflag:
-                if "SUBTOTAL" not in str(block[0]):
-                    tmp = text.split("\n")
-                    tmp = [x for x in tmp if x.strip() != "*"]
-                    if tmp and tmp[0].isnumeric():
-                        data.append(tmp)
-
-            if "QTY\nPRODUCT #" in text:
-                startflag = True
-
-    df = pd.DataFrame({
-        "QTY": [int(x[0]) for x in data],
-        "Item_Num": [x[1] for x in data],
-        "Description": [x[2] for x in data],
-    })
-
-    # Add a MISC node
-    df = pd.concat([
-        df,
-        pd.DataFrame({
-            "QTY": [1],
-            "Item_Num": ["MISC"],
-            "Description": ["N/A"]
-        })
-    ], ignore_index=True)
-
-    parsed_items = []
-    for _, row in df.iterrows():
-        for _ in range(int(row["QTY"])):
-            uid = session["next_uid"]
-            session["next_uid"] += 1
-            session["active_status"][uid] = True
-            parsed_items.append({
-                "ID": str(row["Item_Num"]),
-                "Description": str(row["Description"]),
-                "active": True,
-                "uid": uid
-            })
-    return parsed_items
+def extract_from_pdf(pdf_input):
+    """Parse an uploaded quote file into line items with new session uids."""
+    if not pdf_input.filename.lower().endswith(".csv"):
+        try:
+            logger.info(
+                f"[PDF_LOAD] Session {session.sid[-6:]} loaded PDF '{pdf_input.filename}' "
+                f"at {datetime.utcnow().isoformat(timespec='seconds')}"
+            )
+        except Exception:
+            pass
+    return quote_line_items(session, read_quote_file(pdf_input))
 
-def check_slots():
+def check_slots(quote_network):
     empty_slots = 0
     open_slot_nodes = []
     available_slot_nodes = []
     verbose_error = []
-    for part in session['quote_network']:
+    for part in quote_network:
         part_error = ''
         for slot in part['Slots']:
             if len(slot['Status']) < int(slot['Min']):
@@ -353,68 +644,294 @@ def check_slots():
             verbose_error.append(part_error)
     return empty_slots, list(set(open_slot_nodes)), list(set(available_slot_nodes)), verbose_error
 
-def process_addpart(item, parent_uid):
-    if not item.get('AddPart'):
-        return
+def part_instance(part):
+    """
+    A quote's own copy of a catalog part. Only the slots are copied, since
+    solving writes their Status; the rest is shared with the catalog and never
+    modified.
+    """
+    return dict(part, Slots=[dict(slot) for slot in part['Slots']])
 
-    ghost_ids = item['AddPart'].split(',')
-    for idx, ghost_id in enumerate(ghost_ids):
-        ghost_uid = f"ghost-{parent_uid}-{idx}"
-        # Deep-copy the part from the part database.
-        tmp_part = find(part_db, 'ID', ghost_id)
-        if tmp_part != -1:
-            ghost_part = deepcopy(part_db[tmp_part])
-        else:
-            ghost_part = {'ID': ghost_id,
-                'Name': ghost_id +' - NOT IN DB',
-                'Slots': [],
-                'Alias': None,
-                'AddPart': None,
-                'Tags': []}
-            print('Missing Part:' + ghost_id)
+def process_addpart(quote_network, active_status, item, parent_uid):
+    """Add the ghosts spawned by item's AddParts, and by theirs, to the network."""
+    for prefix, suffix, template in part_db.expansions.get(item['ID'], ()):
+        ghost_uid = f"{prefix}{parent_uid}{suffix}"
+        ghost_part = part_instance(template)
         # Update name and add ghost properties.
-        ghost_part['Name'] += " " + str(len(session['quote_network']))
+        ghost_part['Name'] += " " + str(len(quote_network))
         ghost_part['GhostPart'] = True
         ghost_part['uid'] = ghost_uid
 
         # Ensure active status is set.
-        if ghost_uid not in session['active_status']:
-            session['active_status'][ghost_uid] = True
-        ghost_part['active'] = session['active_status'][ghost_uid]
+        if ghost_uid not in active_status:
+            active_status[ghost_uid] = True
+        ghost_part['active'] = active_status[ghost_uid]
 
         # Add the ghost part to the network.
-        session['quote_network'].append(ghost_part)
+        quote_network.append(ghost_part)
 
-        # Recursively process any AddPart for this ghost part.
-        process_addpart(ghost_part, ghost_uid)
+class Metrics:
+    """
+    Histograms of solve stage timings and quote sizes, rendered in the
+    Prometheus text format by /api/metrics. Every worker process keeps its own.
+    """
+    SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    SIZE_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+    STEP_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 1000, 2000, 5000)
+    HISTOGRAMS = {
+        'jbam_solve_stage_seconds': ("Time spent in each solve stage", SECONDS_BUCKETS),
+        'jbam_quote_parts': ("Parts in each solved quote, ghost parts included", SIZE_BUCKETS),
+        'jbam_quote_slots': ("Slots in each solved quote", SIZE_BUCKETS),
+        'jbam_quote_candidate_pairs': ("Slot pairs scored for pass 1 in each solve", SIZE_BUCKETS),
+        'jbam_pass2_search_steps': ("Depth-first search steps of pass 2, per check tag", STEP_BUCKETS),
+    }
 
-from itertools import combinations
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> [count per bucket, sum, count]
+        self._series = {}
+
+    def observe(self, name, value, **labels):
+        buckets = self.HISTOGRAMS[name][1]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(buckets), 0, 0])
+            for b, bound in enumerate(buckets):
+                if value <= bound:
+                    series[0][b] += 1
+            series[1] += value
+            series[2] += 1
+
+    def record_solve(self, profile):
+        for stage, seconds in profile.seconds.items():
+            self.observe('jbam_solve_stage_seconds', seconds, stage=stage)
+        self.observe('jbam_quote_parts', profile.sizes['parts'])
+        self.observe('jbam_quote_slots', profile.sizes['slots'])
+        self.observe('jbam_quote_candidate_pairs', profile.sizes['pairs'])
+        for tag, steps in profile.steps.items():
+            self.observe('jbam_pass2_search_steps', steps, tag=tag)
+
+    def render(self, counters=()):
+        """
+        The histograms in the Prometheus text format, followed by counters
+        given as (name, type, help, value).
+        """
+        lines = []
+        with self._lock:
+            series = sorted(self._series.items())
+        for name, (help_text, buckets) in self.HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (series_name, labels), (counts, total, count) in series:
+                if series_name != name:
+                    continue
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                prefix = label_text + "," if label_text else ""
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+                suffix = "{" + label_text + "}" if label_text else ""
+                lines.append(f"{name}_sum{suffix} {total}")
+                lines.append(f"{name}_count{suffix} {count}")
+        for name, metric_type, help_text, value in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class QuoteState:
+    """
+    Everything derived from one session's quote: the expanded network, its
+    solved graph and warnings, and the regions of the last solve for incremental
+    re-solving. The session itself only keeps the inputs; `inputs` fingerprints
+    the ones this state was solved from. `history` keeps the last graph
+    responses sent, by version, to patch from, and `body` the serialized full
+    response of the current version. Hold the lock while solving or reading it.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.inputs = None
+        self.network = []
+        self.warnings = []
+        self.warning_parts = {}
+        self.graph = None
+        self.regions = {}
+        self.payload = None
+        self.version = None
+        self.history = OrderedDict()
+        self.body = None
+        self.profile = None
+
+class QuoteStates:
+    """Per-session QuoteState objects, dropping the least recently used ones."""
+    def __init__(self, max_sessions=256):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._states = OrderedDict()
+
+    def get(self, sid):
+        with self._lock:
+            state = self._states.pop(sid, None) or QuoteState()
+            self._states[sid] = state
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+            return state
+
+    def discard(self, sid):
+        with self._lock:
+            self._states.pop(sid, None)
+
+    def __len__(self):
+        return len(self._states)
+
+quote_states = QuoteStates()
+
+class SolveCache:
+    """
+    Solved quotes shared between sessions, keyed by quote_inputs_key, so loading
+    a prebuilt or a standard quote that someone already solved skips the solver.
+    Entries are never modified once stored. The least recently used ones are
+    dropped past max_entries or once their pickled size passes max_bytes.
+    """
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = len(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous['size']
+            self._entries[key] = dict(entry, size=size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.size -= dropped['size']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+solve_cache = SolveCache(
+    max_entries=int(os.environ.get("SOLVE_CACHE_ENTRIES", 512)),
+    max_bytes=int(os.environ.get("SOLVE_CACHE_MB", 64)) * 1024 * 1024,
+)
 
-def update_graph():
-    global part_db,system_tags
-    session['quote_network'] = []
-    session['warnings_list'] = []
-    session['graph'] = []
-    G.clear()
+# Regions of at least SOLVE_PARALLEL_SLOTS slots are solved by a pool of
+# SOLVE_WORKERS processes when a solve has two or more of them; 0 or 1 worker
+# solves everything in the request thread. Like the PDF pool, its processes come
+# from a forkserver and run solver.solve_region_task without importing app.
+SOLVE_WORKERS = int(os.environ.get("SOLVE_WORKERS", 0))
+SOLVE_PARALLEL_SLOTS = int(os.environ.get("SOLVE_PARALLEL_SLOTS", 300))
+solve_pool = None
+solve_lock = threading.Lock()
 
-    # Skip all parts with this tag in initial connection pass
-    exclude_tags = ['Interlock','LaserSafety','NiLayer','Triggering','BNC']
-    # Need to check each of these for total connection
-    check_tags = ['LaserSafety','NiLayer','Triggering']
+def slot_regions(quote_network, slot_list):
+    """
+    Split the quote's slots into regions: groups of parts linked, directly or
+    through other parts, by a name token that a Host slot and a Plug slot both
+    list. Only such slots can ever connect, and the singleton bonus only counts
+    such pairs, so each region can be solved on its own with the same result.
+    Regions are returned as sorted slot_list positions, ordered by their first slot.
+    """
+    parts = UnionFind()
+    for slot in slot_list:
+        parts.make_set(slot['Index'])
+    for bucket in index_slot_tokens(slot_list, range(len(slot_list))).values():
+        if len({slot_list[k]['Type'] for k in bucket}) < 2:
+            continue
+        for k in bucket[1:]:
+            parts.union(slot_list[bucket[0]]['Index'], slot_list[k]['Index'])
+    regions = defaultdict(list)
+    for k, slot in enumerate(slot_list):
+        regions[parts.find(slot['Index'])].append(k)
+    return list(regions.values())
+
+def region_signature(quote_network, slot_list, region):
+    """Everything a region's solution depends on, usable as a cache key."""
+    indices = sorted({slot_list[k]['Index'] for k in region})
+    return tuple(
+        (
+            index - indices[0],
+            quote_network[index]['Name'],
+            quote_network[index]['uid'],
+            quote_network[index]['active'],
+            quote_network[index]['GhostPart'],
+            tuple(quote_network[index]['Tags']),
+            tuple((s['Name'], s['Min'], s['Max'], s['Type']) for s in quote_network[index]['Slots']),
+        )
+        for index in indices
+    )
+
+def solve_regions_in_pool(quote_network, slot_list, regions, profile):
+    """
+    Solve the large regions among regions in the solve pool, when there are at
+    least two of them, and return their results by first slot position. The
+    rest are left to the caller.
+    """
+    global solve_pool
+    large = [region for region in regions if len(region) >= SOLVE_PARALLEL_SLOTS]
+    if SOLVE_WORKERS < 2 or len(large) < 2:
+        return {}
+    with solve_lock:
+        if solve_pool is None:
+            solve_pool = ProcessPoolExecutor(max_workers=SOLVE_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    tasks = []
+    for region in large:
+        region_slots = [slot_list[k] for k in region]
+        parts = {slot['Index']: quote_network[slot['Index']] for slot in region_slots}
+        tasks.append(solve_pool.submit(solve_region_task, parts, region_slots))
+    results = {}
+    for region, task in zip(large, tasks):
+        result, worker_profile = task.result()
+        profile.merge(worker_profile)
+        results[region[0]] = result
+    return results
+
+def update_graph(state, quote, profile=None):
+    """
+    Expand a quote into a network and solve it into state. `quote` holds the
+    inputs: quote_list, active_status, next_uid and custom_slots, as kept in
+    the session. Stage timings and sizes of the solve go to state.profile.
+    """
+    if profile is None:
+        profile = SolveProfile()
+    solve_started = started = time.perf_counter()
+    quote_network = []
+    warnings_list = []
+    graph = nx.DiGraph()
 
-    # Custom arrows for visualization
-    custom_arrows = {'InterlockPhone':'InterlockPhone.svg','InterlockRound':'InterlockRound.svg','InterlockPhoneLSC':'InterlockPhone.svg','InterlockRoundLSC':'InterlockRound.svg','InterlockPlug':'InterlockPlug.svg','InterlockLUNF':'InterlockLUNF.svg','BNC':'BNC.svg','BNCBB':'BNC.svg'}
-    
     # Assign each line item a unique id
-    for line_item in session['quote_list']:
+    for line_item in quote['quote_list']:
         if "uid" not in line_item:
-            line_item["uid"] = session['next_uid']
-            session['next_uid'] += 1
-            session['active_status'][line_item["uid"]] = True
+            line_item["uid"] = quote['next_uid']
+            quote['next_uid'] += 1
+            quote['active_status'][line_item["uid"]] = True
         # Build out the base part
-        loc = find(part_db, "ID", line_item["ID"])
-        if loc != -1:
-            tmp_item = deepcopy(part_db[loc])
+        catalog_part = part_db.get(line_item["ID"])
+        if catalog_part:
+            tmp_item = part_instance(catalog_part)
             line_item['Description'] = tmp_item['Name']
         else:
             tmp_item = {
@@ -429,20 +946,20 @@ def update_graph():
         # Make unique name so they appear on front end as individual items
         tmp_item['Name'] += " " + str(line_item['uid'])
         tmp_item['GhostPart'] = False
-        tmp_item['active'] = session['active_status'].get(line_item["uid"], True)
+        tmp_item['active'] = quote['active_status'].get(line_item["uid"], True)
         tmp_item['uid'] = line_item['uid']
 
         # Add part to quote network
-        session['quote_network'].append(tmp_item)
+        quote_network.append(tmp_item)
 
         # If the part spawns ghost items
         if tmp_item.get('AddPart'):
-            process_addpart(tmp_item, line_item['uid'])
+            process_addpart(quote_network, quote['active_status'], tmp_item, line_item['uid'])
 
     # Custom slots added by user
-    if 'custom_slots' in session:
-        for custom in session['custom_slots']:
-            for part in session['quote_network']:
+    if 'custom_slots' in quote:
+        for custom in quote['custom_slots']:
+            for part in quote_network:
                 if part['ID'] == custom['ID']:
                     slot_parts = custom['slot'].split(':')
                     if len(slot_parts) == 4:
@@ -459,247 +976,83 @@ def update_graph():
                                 'Type': slot_type
                             })
                     break
+    profile.add('expand', started)
 
     # Initialize all slot statuses as empty
-    for i in range(len(session['quote_network'])):
-        for j in range(len(session['quote_network'][i]['Slots'])):
-            session['quote_network'][i]['Slots'][j]['Status'] = []
+    for i in range(len(quote_network)):
+        for j in range(len(quote_network[i]['Slots'])):
+            quote_network[i]['Slots'][j]['Status'] = []
     
     # Add all nodes to front end graph
-    for item in session['quote_network']:
-        G.add_node(item["Name"])
+    for item in quote_network:
+        graph.add_node(item["Name"])
 
     # Transform quote network into slot list
     slot_list = []
-    for i,item in enumerate(session['quote_network']):
+    for i,item in enumerate(quote_network):
         slot_list += [{'Index':i,'Name':x['Name'],'GhostPart':item['GhostPart'],'Min':x['Min'],'Max':x['Max'],'Type':x['Type'],'Loc':j} for j,x in enumerate(item['Slots'])]
-    n = len(slot_list)
-
-    # Empty matrices. Score, singletons and distance between parts. We connect singletons, then by decreasing score then by increasing distance.
-    conn_score = np.zeros((n, n))
-    singletons = np.zeros((n, n))
-    conn_distance = np.zeros((n, n))
-
-    # Determine scores, singletons and distances
-    for i in range(n):
-        for j in range(i + 1, n):
-            # Skip shared tags between slots
-            if set(session['quote_network'][slot_list[i]['Index']]['Tags']).intersection(set(exclude_tags)).intersection(set(session['quote_network'][slot_list[j]['Index']]['Tags']).intersection(set(exclude_tags))):
-                continue
-            # Skip LaserSafety and Interlock tagged slots (when BOTH slots have either of these tags)
-            if set(['Interlock','LaserSafety']).intersection(session['quote_network'][slot_list[i]['Index']]['Tags']) and set(['Interlock','LaserSafety']).intersection(session['quote_network'][slot_list[j]['Index']]['Tags']):
-                continue
-            # Skip BNC and Triggering tagged slots (when BOTH slots have either of these tags)
-            if set(['BNC','Triggering']).intersection(session['quote_network'][slot_list[i]['Index']]['Tags']) and set(['BNC','Triggering']).intersection(session['quote_network'][slot_list[j]['Index']]['Tags']):
-                continue
-            if slot_list[i]['Index'] != slot_list[j]['Index']:
-                conn_score[i][j] = 1
-                # Check 1: submin on either slot
-                if slot_list[i]['Min'] > 0 and slot_list[j]['Min'] > 0:
-                    conn_score[i][j] += 6
-                elif slot_list[i]['Min'] > 0 or slot_list[j]['Min'] > 0:
-                    conn_score[i][j] += 3
-                # Check 2: ghost part
-                if slot_list[i]['GhostPart'] == False and slot_list[j]['GhostPart'] == False:
-                    conn_score[i][j] += 2
-                elif slot_list[i]['GhostPart'] == False or slot_list[j]['GhostPart'] == False:
-                    conn_score[i][j] += 1
-                    
-                if set(slot_list[i]["Name"].split('|')).intersection(set(slot_list[j]["Name"].split('|'))) and slot_list[i]['Type'] != slot_list[j]['Type']:
-                    singletons[i][j] = 1
-                conn_distance[i][j] = abs(slot_list[i]['Index']-slot_list[j]['Index'])
-
-    # Adding 10 points here is sufficient to make singletons the first to connect
-    conn_score = conn_score + unique_ones(singletons) * 10
-
-    # Form slot pairs based on priority
-    indices = np.indices(conn_score.shape).reshape(2, -1).T
-    filtered_indices = [idx for idx in indices if conn_score[idx[0], idx[1]] > 0]
-    sorted_indices = sorted(filtered_indices, key=lambda idx: (-conn_score[idx[0], idx[1]], conn_distance[idx[0], idx[1]]))
-    sorted_list = [list(idx) for idx in sorted_indices]
-    
-    # Pass 1: connect all parts without tags indicated by exclude_tags
-    for pair in sorted_list:
-        slot1 = session['quote_network'][slot_list[pair[0]]['Index']]['Slots'][slot_list[pair[0]]['Loc']]
-        slot2 = session['quote_network'][slot_list[pair[1]]['Index']]['Slots'][slot_list[pair[1]]['Loc']]
-        part1 = session['quote_network'][slot_list[pair[0]]['Index']]
-        part2 = session['quote_network'][slot_list[pair[1]]['Index']]
-
-        # Ensure we don't create a repeated connection
-        part1uid = [item for sublist in [x['Status'] for x in part1['Slots']] for item in sublist]
-        part2uid = [item for sublist in [x['Status'] for x in part2['Slots']] for item in sublist]
-        if part1['uid'] in part2uid or part2['uid'] in part1uid:
-            continue
-
-        if set(slot1["Name"].split('|')).intersection(set(slot2["Name"].split('|'))) and slot1['Type'] != slot2['Type'] and len(slot1['Status']) < int(slot1['Max']) and len(slot2['Status']) < int(slot2['Max']) and part1['active'] and part2['active']:
-            # This is a directed graph, so we always connect from Host to Plug
-            if slot1['Type'] == 'Host':
-                G.add_edge(part1["Name"], part2["Name"], fromSlot=slot1["Name"], toSlot=slot2["Name"])
-            else:
-                G.add_edge(part2["Name"], part1["Name"], fromSlot=slot2["Name"], toSlot=slot1["Name"])
-            
-            # Add part uid to status
-            slot1["Status"].append(part2['uid'])
-            slot2["Status"].append(part1['uid'])
-
-        # Pass 2: Try permutations to validate networks formed by check_tags
-    for tag in check_tags:
-        interlock_pairs = []
-
-        # Filter parts relevant to this tag
-        tag_set = {'LaserSafety', 'Interlock'} if tag == "LaserSafety" else {'Triggering', 'BNC'} if tag == "Triggering" else {tag}
-        interlock_parts = [x for x in session['quote_network'] if set(x['Tags']).intersection(tag_set)]
-
-        # Precompute slot indices and tags for each slot
-        slot_info = [
-            (
-                i,
-                slot_list[i],
-                session['quote_network'][slot_list[i]['Index']],
-                set(session['quote_network'][slot_list[i]['Index']]['Tags']),
-                set(slot_list[i]['Name'].split('|'))
-            )
-            for i in range(n)
-        ]
-
-        for i in range(n):
-            idx1, slot1, part1, tags1, names1 = slot_info[i]
-            for j in range(i + 1, n):
-                idx2, slot2, part2, tags2, names2 = slot_info[j]
-                if part1 is not part2 and names1.intersection(names2):
-                    if tag == 'LaserSafety':
-                        if {'LaserSafety', 'Interlock'}.intersection(tags1) and {'LaserSafety', 'Interlock'}.intersection(tags2):
-                            interlock_pairs.append([i, j])
-                    elif tag == 'Triggering':
-                        if {'Triggering', 'BNC'}.intersection(tags1) and {'Triggering', 'BNC'}.intersection(tags2):
-                            interlock_pairs.append([i, j])
-                    elif tag in tags1 and tag in tags2:
-                        interlock_pairs.append([i, j])
-
-        best_perm = interlock_pairs
-        perms = 1000
-
-        interlock_graph = nx.Graph()
-        i_nodes = set()
-
-        for part in interlock_parts:
-            node_name = 'I_' + part['Name'] if tag in part['Tags'] else part['Name']
-            interlock_graph.add_node(node_name)
-            if node_name.startswith('I_'):
-                i_nodes.add(node_name)
-
-        i_nodes = list(i_nodes)
-        valid_network = False
-
-        quote_network_base = deepcopy(session['quote_network'])  # base copy once, reuse
-        for _ in range(perms):
-            random.shuffle(interlock_pairs)
-            interlock_graph.remove_edges_from(list(interlock_graph.edges))
-            quote_network_tmp = deepcopy(quote_network_base)
-
-            for pair in interlock_pairs:
-                s1, s2 = slot_list[pair[0]], slot_list[pair[1]]
-                part1 = quote_network_tmp[s1['Index']]
-                part2 = quote_network_tmp[s2['Index']]
-                slot1 = part1['Slots'][s1['Loc']]
-                slot2 = part2['Slots'][s2['Loc']]
-
-                uid1 = part1['uid']
-                uid2 = part2['uid']
-                uids1 = part1['Slots']
-                uids2 = part2['Slots']
-
-                if uid1 in [u for slot in uids2 for u in slot['Status']] or uid2 in [u for slot in uids1 for u in slot['Status']]:
-                    continue
-
-                if slot1['Type'] != slot2['Type'] and len(slot1['Status']) < int(slot1['Max']) and len(slot2['Status']) < int(slot2['Max']) and part1['active'] and part2['active']:
-                    slot1["Status"].append(uid2)
-                    slot2["Status"].append(uid1)
-                    n1 = part1["Name"] if part1["Name"] in interlock_graph else 'I_' + part1["Name"]
-                    n2 = part2["Name"] if part2["Name"] in interlock_graph else 'I_' + part2["Name"]
-                    interlock_graph.add_edge(n1, n2)
-
-            if len(i_nodes) > 1:
-                connected = nx.node_connected_component(interlock_graph, i_nodes[0])
-                if all(n in connected for n in i_nodes):
-                    valid_network = True
-                    best_perm = interlock_pairs[:]
-                    break
-            else:
-                valid_network = True
-                break
-
-        if not valid_network:
-            session['warnings_list'].append(f'{tag} not valid')
-
-        # Final connection using best_perm
-        for pair in best_perm:
-            s1, s2 = slot_list[pair[0]], slot_list[pair[1]]
-            part1 = session['quote_network'][s1['Index']]
-            part2 = session['quote_network'][s2['Index']]
-            slot1 = part1['Slots'][s1['Loc']]
-            slot2 = part2['Slots'][s2['Loc']]
-
-            uid1 = part1['uid']
-            uid2 = part2['uid']
-            uids1 = part1['Slots']
-            uids2 = part2['Slots']
 
-            if uid1 in [u for slot in uids2 for u in slot['Status']] or uid2 in [u for slot in uids1 for u in slot['Status']]:
-                continue
-
-            if tag not in part1['Tags'] and tag not in part2['Tags']:
-                if tag == 'LaserSafety' and 'Interlock' in part1['Tags'] and 'Interlock' in part2['Tags']:
-                    pass
-                else:
-                    continue
-
-            if slot1['Type'] != slot2['Type'] and len(slot1['Status']) < int(slot1['Max']) and len(slot2['Status']) < int(slot2['Max']) and part1['active'] and part2['active']:
-                if slot1['Type'] == 'Host':
-                    slot1, slot2 = slot2, slot1
-                    part1, part2 = part2, part1
-
-                if slot1['Name'] in custom_arrows:
-                    G.add_edge(part2["Name"], part1["Name"], arrows={
-                        "from": {
-                            "enabled": True,
-                            "type": "image",
-                            "src": f"/images/{custom_arrows[slot1['Name']]}",
-                            "scaleFactor": 1,
-                            "imageWidth": 40,
-                            "imageHeight": 40
-                        },
-                        "to": {"enabled": False},
-                    }, arrowStrikethrough=False,
-                    fromSlot=slot1["Name"],
-                    toSlot=slot2["Name"])
-                else:
-                    G.add_edge(part2["Name"], part1["Name"],fromSlot=slot1["Name"],toSlot=slot2["Name"])
-
-                slot1["Status"].append(part2['uid'])
-                slot2["Status"].append(part1['uid'])
-
-    # System tag checks
-    active_parts = [x for x in session['quote_network'] if x['active']]
-    active_tags = [tag for p in active_parts for tag in p['Tags']]
-    for _, row in system_tags.iterrows():
-        if row['Type'] == 'Require':
-            if all(any(cond.strip() in x['Tags'] for x in active_parts) for cond in row['Condition1'].split(',')) and row['Condition2'] not in active_tags:
-                session['warnings_list'].append(row['Warning'])
-        elif row['Type'] == 'Exclude':
-            if any(row['Condition1'] in x['Tags'] for x in active_parts) and row['Condition2'] in active_tags:
-                session['warnings_list'].append(row['Warning'])
-
-    # Final graph export
-    session['graph'] = json_graph.node_link_data(G)
-    for u, v, edge_data in G.edges(data=True):
-        for link in session['graph']["links"]:
-            if link["source"] == u and link["target"] == v:
-                link.update(edge_data)
-                break
-
-
-def graph_to_json():
+    # Solve region by region, reusing the last solve's result for regions the
+    # change did not touch. A state without a previous solve is rebuilt in full.
+    started = time.perf_counter()
+    previous = state.regions
+    regions = slot_regions(quote_network, slot_list)
+    signatures = [region_signature(quote_network, slot_list, region) for region in regions]
+    profile.add('regions', started)
+    pending = [region for region, signature in zip(regions, signatures) if signature not in previous]
+    pooled = solve_regions_in_pool(quote_network, slot_list, pending, profile)
+    solved = {}
+    reused = 0
+    tag_networks = defaultdict(list)
+    for region, signature in zip(regions, signatures):
+        result = previous.get(signature)
+        if result is not None:
+            reused += 1
+        else:
+            result = pooled.get(region[0])
+        if result is None:
+            result = solve_region(quote_network, slot_list, region, profile)
+        else:
+            for k, status in zip(region, result['status']):
+                quote_network[slot_list[k]['Index']]['Slots'][slot_list[k]['Loc']]['Status'] = list(status)
+        solved[signature] = result
+        for u, v, edge_data in result['edges']:
+            graph.add_edge(u, v, **edge_data)
+        for tag, network in result['tag_networks'].items():
+            if network[0]:
+                tag_networks[tag].append(network)
+    state.regions = solved
+    profile.sizes['parts'] = len(quote_network)
+    profile.sizes['slots'] = len(slot_list)
+    profile.sizes['pairs'] = sum(result['pairs'] for result in solved.values())
+    profile.sizes['regions'] = len(solved)
+    profile.sizes['reused_regions'] = reused
+
+    for tag in CHECK_TAGS:
+        # Tagged parts without slots cannot join any network
+        loose = sum(1 for part in quote_network if tag in part['Tags'] and not part['Slots'])
+        networks = tag_networks[tag]
+        if len(networks) + loose > 1 or not all(valid for _, valid in networks):
+            warnings_list.append(f'{tag} not valid')
+
+    # System tag checks, keeping the parts that set off each warning
+    started = time.perf_counter()
+    warning_parts = {}
+    for warning, triggers in system_rules.check(quote_network):
+        warnings_list.append(warning)
+        parts = warning_parts.setdefault(warning, [])
+        parts += [t for t in triggers if t not in parts]
+    profile.add('system_tags', started)
+
+    state.network = quote_network
+    state.warnings = warnings_list
+    state.warning_parts = warning_parts
+    state.graph = graph
+    profile.add('solve', solve_started)
+    state.profile = profile
+
+
+def graph_to_json(state, quote):
     """
     Build the merged graph + a sidebar-friendly items list that nests ghosts
     under their user-added parent(s) with no duplicate top-level rows.
@@ -707,31 +1060,29 @@ def graph_to_json():
     """
     from collections import defaultdict
 
-    name_to_data = {nd["Name"]: nd for nd in session["quote_network"]}
-    adjacency_map = {}
-    for u, v in G.edges():
-        adjacency_map.setdefault(u, set()).add(v)
-        adjacency_map.setdefault(v, set()).add(u)
+    name_to_data = {nd["Name"]: nd for nd in state.network}
 
-    # === Compute slot usage counts ===
+    # === Adjacency and slot usage counts, in one pass over the edges ===
+    adjacency_map = {}
     slot_usage = defaultdict(int)
-    for edge in G.edges(data=True):
-        src = edge[0]
-        tgt = edge[1]
-        src_slot = edge[2].get("fromSlot")
-        tgt_slot = edge[2].get("toSlot")
+    for src, tgt, edge_data in state.graph.edges(data=True):
+        adjacency_map.setdefault(src, set()).add(tgt)
+        adjacency_map.setdefault(tgt, set()).add(src)
+        src_slot = edge_data.get("fromSlot")
+        tgt_slot = edge_data.get("toSlot")
         if src_slot:
             slot_usage[(src, src_slot)] += 1
         if tgt_slot:
             slot_usage[(tgt, tgt_slot)] += 1
 
     # === Merge nodes ===
+    # Each node's merge key is computed once; the first node with a key represents it
     merge_dict = {}
-    for n in G.nodes():
+    name_to_rep = {}
+    for n in state.graph.nodes():
         nd = name_to_data.get(n, {})
         if not nd:
             continue
-        node_name = n
         key = (
             nd.get("ID"),
             nd.get("GhostPart", False),
@@ -739,13 +1090,13 @@ def graph_to_json():
             tuple(sorted(adjacency_map.get(n, []))),
         )
         if key not in merge_dict:
-            merge_dict[key] = {"representative_name": node_name, "uids": [], "count": 0}
+            merge_dict[key] = {"representative_name": n, "uids": [], "count": 0}
         merge_dict[key]["count"] += 1
         merge_dict[key]["uids"].append(nd.get("uid"))
+        name_to_rep[n] = merge_dict[key]["representative_name"]
 
     merged_nodes = []
-    name_to_rep = {}
-    for merge_key, info in merge_dict.items():
+    for info in merge_dict.values():
         rep_name = info["representative_name"]
         rep_nd = name_to_data[rep_name]
         label_no_index = rep_nd["Name"].rsplit(" ", 1)[0]
@@ -776,22 +1127,9 @@ def graph_to_json():
             "Slots": enriched_slots,
         })
 
-        for n in G.nodes():
-            nd = name_to_data.get(n, {})
-            if not nd:
-                continue
-            current_key = (
-                nd.get("ID"),
-                nd.get("GhostPart", False),
-                nd.get("active", True),
-                tuple(sorted(adjacency_map.get(n, []))),
-            )
-            if current_key == merge_key:
-                name_to_rep[n] = rep_name
-
     # === Merge edges ===
     merged_edges = {}
-    for u, v, edge_data in G.edges(data=True):
+    for u, v, edge_data in state.graph.edges(data=True):
         rep_u = name_to_rep.get(u, u)
         rep_v = name_to_rep.get(v, v)
         if rep_u == rep_v:
@@ -808,7 +1146,7 @@ def graph_to_json():
 
     # === Ghost hierarchy for sidebar ===
     ghosts_by_parent = defaultdict(list)
-    for part in session["quote_network"]:
+    for part in state.network:
         if part.get("GhostPart"):
             uid = str(part.get("uid", ""))
             if uid.startswith("ghost-"):
@@ -823,7 +1161,7 @@ def graph_to_json():
 
     user_counts = {}
     uids_by_id = defaultdict(list)
-    for p in session["quote_list"]:
+    for p in quote["quote_list"]:
         pid = p["ID"]
         desc = p["Description"]
         uid = str(p.get("uid"))
@@ -852,7 +1190,7 @@ def graph_to_json():
         })
 
     # === Slot checks / status ===
-    empty_slots, open_slot_nodes, available_slot_nodes, verbose_error = check_slots()
+    empty_slots, open_slot_nodes, available_slot_nodes, verbose_error = check_slots(state.network)
     verbose_error = "\n".join(verbose_error)
     status_message = verbose_error if empty_slots else "All slots filled."
 
@@ -860,34 +1198,381 @@ def graph_to_json():
         "nodes": merged_nodes,
         "edges": merged_edges_list,
         "items": merged_items,
-        "open_slot_nodes": list(set(open_slot_nodes)),
-        "available_slot_nodes": list(set(available_slot_nodes)),
+        "open_slot_nodes": sorted(set(open_slot_nodes)),
+        "available_slot_nodes": sorted(set(available_slot_nodes)),
         "status_message": status_message,
-        "warnings": session["warnings_list"],
+        "warnings": state.warnings,
+        "warning_parts": state.warning_parts,
     }
 
 
 
+def quote_state():
+    """The QuoteState of the current session."""
+    return quote_states.get(session.sid)
+
+def quote_inputs_key(quote):
+    """
+    Fingerprint of everything a solve depends on: the line items in order with
+    their uids, the parts switched off, the custom slots and the catalog version.
+    Descriptions only count for parts the catalog does not know, since the
+    catalog's name replaces them otherwise. Equal quotes in different sessions
+    get the same key.
+    """
+    items = [(item['ID'], item.get('uid'), None if item['ID'] in part_db else item.get('Description'))
+             for item in quote['quote_list']]
+    # Parts default to active, so only the other flags matter
+    inactive = sorted(f"{uid!r}={active!r}" for uid, active in quote['active_status'].items() if active is not True)
+    inputs = (items, inactive, quote.get('custom_slots', []), part_db.version)
+    return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+def solve_cache_entry(state, quote):
+    """What solve_cache keeps of a solved quote to restore the state and its response."""
+    return {
+        'descriptions': [line_item['Description'] for line_item in quote['quote_list']],
+        'network': state.network,
+        'warnings': state.warnings,
+        'warning_parts': state.warning_parts,
+        'graph': state.graph,
+        'regions': state.regions,
+        'payload': state.payload,
+        'version': state.version,
+    }
+
+def solve_and_export(state, quote, profile=None):
+    """Solve quote into state, build its graph response and record the solve's metrics."""
+    update_graph(state, quote, profile)
+    state.inputs = quote_inputs_key(quote)
+    started = time.perf_counter()
+    state.payload = graph_to_json(state, quote)
+    state.version = graph_version(state.payload)
+    state.profile.add('export', started)
+    metrics.record_solve(state.profile)
+
+def solve_and_cache(state, quote, profile=None):
+    """
+    solve_and_export, then store the solve in solve_cache under the inputs it
+    was solved from, and under the inputs as given when those could be looked
+    up (every line item already had a uid).
+    """
+    inputs = quote_inputs_key(quote)
+    cacheable = all('uid' in item for item in quote['quote_list'])
+    solve_and_export(state, quote, profile)
+    entry = solve_cache_entry(state, quote)
+    solve_cache.put(state.inputs, entry)
+    if cacheable and inputs != state.inputs:
+        solve_cache.put(inputs, entry)
+
+def solved_state():
+    """
+    The current session's QuoteState, re-solved first if the session's inputs
+    changed since its last solve (or this worker has not solved it yet).
+    Solves are looked up in solve_cache before running the solver.
+    Call with the state's lock held.
+    """
+    state = quote_state()
+    inputs = quote_inputs_key(session)
+    if state.graph is not None and state.inputs == inputs:
+        return state
+
+    # Line items without a uid get one from the solver, so they cannot hit the cache
+    cacheable = all('uid' in item for item in session['quote_list'])
+    cached = solve_cache.get(inputs) if cacheable else None
+    if cached is not None:
+        for line_item, description in zip(session['quote_list'], cached['descriptions']):
+            line_item['Description'] = description
+        state.network = cached['network']
+        state.warnings = cached['warnings']
+        state.warning_parts = cached['warning_parts']
+        state.graph = cached['graph']
+        state.regions = cached['regions']
+        state.payload = cached['payload']
+        state.version = cached['version']
+        state.inputs = quote_inputs_key(session)
+    else:
+        solve_and_cache(state, session)
+        logger.info(f"[SOLVE] Session {session.sid[-6:]} {state.profile.fields()}")
+    logger.debug(f"[SOLVE_CACHE] {'hit' if cached else 'miss'} {inputs[:12]}: "
+                 f"{solve_cache.hits} hits, {solve_cache.misses} misses, {len(solve_cache)} entries")
+    # Solving fills in uids and descriptions on the inputs
+    if state.inputs != inputs:
+        session.modified = True
+    return state
+
+def solve_quote():
+    """Re-solve the current session's changed quote and return the graph response."""
+    # Routes edit the inputs in place, which the session cannot see on its own
+    session.modified = True
+    with quote_state().lock:
+        return graph_response(solved_state())
+
+# Graph responses each session's state keeps to patch from
+GRAPH_HISTORY = 8
+
+def graph_version(payload):
+    """Version of a graph response: a hash of its content, equal in every worker."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+def pointer_token(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+def json_patch(old, new, path=''):
+    """
+    RFC 6902 operations turning old into new. Objects are patched key by key;
+    lists are matched element by element so that an added or removed node,
+    edge or item is one operation, and elements changed in place are patched.
+    """
+    if old == new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{'op': 'remove', 'path': f"{path}/{pointer_token(key)}"} for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': f"{path}/{pointer_token(key)}", 'value': value})
+            else:
+                ops += json_patch(old[key], value, f"{path}/{pointer_token(key)}")
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        matcher = SequenceMatcher(None, [json.dumps(x, sort_keys=True) for x in old],
+                                  [json.dumps(x, sort_keys=True) for x in new], autojunk=False)
+        # From the end backwards, so the positions of earlier blocks still hold
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == 'equal':
+                continue
+            common = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+            ops += [{'op': 'remove', 'path': f"{path}/{i}"} for i in range(i2 - 1, i1 + common - 1, -1)]
+            ops += [{'op': 'add', 'path': f"{path}/{i1 + k - j1}", 'value': new[k]} for k in range(j1 + common, j2)]
+            for k in range(common):
+                ops += json_patch(old[i1 + k], new[j1 + k], f"{path}/{i1 + k}")
+        return ops
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+def graph_response(state):
+    """
+    The state's graph as a response tagged with its version. A client that
+    sends the version it holds in X-Graph-Version gets {version, base, patch}
+    with a JSON patch from that version instead, if this worker still has it;
+    otherwise the full graph, serialized once per version. The version is also
+    the response's ETag. Call with the state's lock held.
+    """
+    state.history[state.version] = state.payload
+    state.history.move_to_end(state.version)
+    while len(state.history) > GRAPH_HISTORY:
+        state.history.popitem(last=False)
+    base = request.headers.get('X-Graph-Version')
+    if base in state.history:
+        response = jsonify({'version': state.version, 'base': base, 'patch': json_patch(state.history[base], state.payload)})
+    else:
+        if state.body is None or state.body[0] != state.version:
+            state.body = (state.version, jsonify(dict(state.payload, version=state.version)).get_data())
+        response = app.response_class(state.body[1], mimetype=app.json.mimetype)
+    return version_headers(response, state.version)
+
+def version_headers(response, version):
+    """Tag a graph response, full, patch or 304, with its version and caching headers."""
+    response.headers['X-Graph-Version'] = version
+    response.set_etag(version)
+    # Browsers revalidate with If-None-Match, and keep patches apart from full graphs
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('X-Graph-Version')
+    return response
+
+# Uploads of at least JOB_MIN_BYTES are loaded by a background job when the
+# client asks for one (job=1), so big PDFs do not hold a request open while they
+# are parsed and solved. Jobs run on JOB_WORKERS threads of the worker that took
+# the upload; their status goes to JOB_DIR so every worker can report it.
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(tempfile.gettempdir(), "jbam_jobs"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", 16))
+JOB_MIN_BYTES = int(os.environ.get("JOB_MIN_BYTES", 256 * 1024))
+JOB_TTL = 60 * 60
+JOB_POLL_SECONDS = 0.25
+# Progress is written at most this often; status changes are written at once
+JOB_WRITE_SECONDS = 0.5
+# Queued and running jobs are rewritten with a fresh heartbeat this often, and a
+# job whose heartbeat is older than JOB_LOST_SECONDS died with its worker
+JOB_HEARTBEAT_SECONDS = 4 * JOB_WRITE_SECONDS
+JOB_LOST_SECONDS = 5 * JOB_HEARTBEAT_SECONDS
+# Event streams end after this long without news; clients reconnect with Last-Event-ID
+JOB_STREAM_IDLE_SECONDS = 60
+# Finished jobs are unpickled from JOB_DIR, so only this user may write there
+os.makedirs(JOB_DIR, mode=0o700, exist_ok=True)
+if os.stat(JOB_DIR).st_uid != os.getuid():
+    raise RuntimeError(f"JOB_DIR {JOB_DIR} belongs to another user; set JOB_DIR to a private directory")
+os.chmod(JOB_DIR, 0o700)
+job_pool = None
+job_lock = threading.Lock()
+pending_jobs = {}
+
+class QuoteJob:
+    """
+    One session's quote upload being parsed, expanded and solved in the
+    background. Each finished stage is appended to the job's events. The job's
+    status is written to JOB_DIR/<id>.json as it goes, with this process's pid
+    and a heartbeat, and once done the new inputs and the solved quote go to
+    JOB_DIR/<id>.pickle for get_job to hand to the session.
+    """
+    def __init__(self, sid, filename, file_bytes, quote):
+        self.id = uuid.uuid4().hex
+        self.sid = sid
+        self.filename = filename
+        self.file_bytes = file_bytes
+        self.quote = quote
+        self.status = 'queued'
+        self.events = []
+        self.error = None
+        self.created = time.time()
+        self.written = 0
+        # The job's thread and the heartbeat thread both write; the last write wins
+        self.lock = threading.Lock()
+        self.write()
+
+    def write(self):
+        with self.lock:
+            self.written = time.time()
+            data = {'id': self.id, 'session': self.sid, 'file': self.filename, 'status': self.status,
+                    'events': self.events, 'error': self.error, 'applied': False,
+                    'pid': os.getpid(), 'heartbeat': self.written}
+            write_job_file(job_path(self.id, '.json'), json.dumps(data).encode())
+
+    def progress(self, stage):
+        self.events.append({'stage': stage, 'seconds': round(time.time() - self.created, 3)})
+        if time.time() - self.written >= JOB_WRITE_SECONDS:
+            self.write()
+
+    def run(self):
+        self.status = 'running'
+        self.write()
+        try:
+            quote = self.quote
+            rows = read_quote_file(FileStorage(BytesIO(self.file_bytes), filename=self.filename))
+            self.progress('parse')
+            quote['quote_list'] = quote_line_items(quote, rows)
+            state = QuoteState()
+            solve_and_cache(state, quote, SolveProfile(on_stage=self.progress))
+            logger.info(f"[SOLVE] Job {self.id[:8]} {state.profile.fields()}")
+            result = {'quote': quote, 'inputs': state.inputs, 'entry': solve_cache_entry(state, quote)}
+            write_job_file(job_path(self.id, '.pickle'), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+            self.status = 'done'
+        except Exception as e:
+            logger.exception(f"[JOB] {self.id[:8]} failed")
+            self.status = 'error'
+            self.error = str(e)
+        self.file_bytes = None
+        self.write()
+        with job_lock:
+            pending_jobs.pop(self.id, None)
+
+def beat_jobs():
+    """Rewrite this process's pending jobs whenever they were not written for a while."""
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS / 2)
+        with job_lock:
+            jobs = list(pending_jobs.values())
+        for job in jobs:
+            if time.time() - job.written >= JOB_HEARTBEAT_SECONDS:
+                job.write()
+
+def job_path(job_id, ext):
+    # Job ids are hex, so nothing else can be named
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    return os.path.join(JOB_DIR, job_id + ext)
+
+def write_job_file(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def read_job_file(path):
+    """A job's status file, with an unfinished job whose heartbeat stopped reported as lost."""
+    with open(path) as f:
+        job = json.load(f)
+    if job['status'] in ('queued', 'running') and time.time() - job['heartbeat'] > JOB_LOST_SECONDS:
+        job['status'] = 'error'
+        job['error'] = 'job lost'
+    return job
+
+def read_job(job_id):
+    """The status of one of this session's jobs, or None."""
+    path = job_path(job_id, '.json')
+    if path is None or not os.path.exists(path):
+        return None
+    job = read_job_file(path)
+    return job if job['session'] == session.sid else None
+
+def prune_jobs():
+    """Delete the files of jobs older than JOB_TTL."""
+    cutoff = time.time() - JOB_TTL
+    for name in os.listdir(JOB_DIR):
+        path = os.path.join(JOB_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def submit_quote_job(file, file_bytes):
+    """Start loading an upload into the session in the background; None when the pool is full."""
+    global job_pool
+    with job_lock:
+        if len(pending_jobs) >= JOB_MAX_PENDING:
+            return None
+        if job_pool is None:
+            job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="quote-job")
+            threading.Thread(target=beat_jobs, name="quote-job-heartbeat", daemon=True).start()
+        prune_jobs()
+        # Loading replaces the line items; uids continue from the session's
+        quote = {'quote_list': [], 'active_status': dict(session['active_status']),
+                 'next_uid': session['next_uid'], 'custom_slots': list(session.get('custom_slots', []))}
+        job = QuoteJob(session.sid, file.filename, file_bytes, quote)
+        pending_jobs[job.id] = job
+    job_pool.submit(job.run)
+    logger.info(f"[JOB] Session {session.sid[-6:]} queued job {job.id[:8]} for '{file.filename}' ({len(file_bytes)} bytes)")
+    return job
+
 @app.before_request
 def init_session():
-    if 'quote_network' not in session:
-        global part_db
-        session['quote_network'] = []
-        session['warnings_list'] = []
+    if request.path == '/api/metrics':
+        return
+    if 'quote_list' not in session:
         session['next_uid'] = 1
         session['active_status'] = {}
-        session['graph'] = []
         session['quote_list'] = []
         session['custom_slots'] = []
-        update_graph()
-    session.modified = True
+    # Sessions saved before solved state moved out of them
+    for key in ('quote_network', 'warnings_list', 'graph'):
+        if key in session:
+            del session[key]
         
 @app.route("/api/graph", methods=["GET"])
 def get_graph():
-    empty_slots, open_slot_nodes, available_slot_nodes, verbose_error = check_slots()
-    verbose_error = ('\n').join(verbose_error)
-    status_message = f"{verbose_error}" if empty_slots else "All slots filled."
-    return jsonify(graph_to_json())
+    """The current graph; 304 when If-None-Match already names its version."""
+    with quote_state().lock:
+        state = solved_state()
+        if request.if_none_match.contains(state.version):
+            return version_headers(app.response_class(status=304), state.version)
+        return graph_response(state)
+
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Solve timings and quote sizes of this worker, in the Prometheus text format.
+    Needs the METRICS_TOKEN bearer token, or a logged-in session if none is set.
+    """
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return jsonify({"error": "Not authorized"}), 401
+    counters = [
+        ('jbam_solve_cache_hits_total', 'counter', "Solves answered from the solve cache", solve_cache.hits),
+        ('jbam_solve_cache_misses_total', 'counter', "Solves the solve cache could not answer", solve_cache.misses),
+        ('jbam_solve_cache_entries', 'gauge', "Solved quotes in the solve cache", len(solve_cache)),
+        ('jbam_solve_cache_bytes', 'gauge', "Pickled size of the solve cache", solve_cache.size),
+        ('jbam_sessions', 'gauge', "Sessions with solved state in this worker", len(quote_states)),
+    ]
+    return Response(metrics.render(counters), mimetype="text/plain; version=0.0.4")
 
 @app.route("/api/add_item", methods=["POST"])
 def add_item():
@@ -902,7 +1587,7 @@ def add_item():
             continue
 
         # Find part entry
-        part_entry = next((part for part in part_db if part["ID"] == item_id), None)
+        part_entry = part_db.get(item_id)
         desc = part_entry["Name"] if part_entry else "Unknown Part"
 
         new_item = {
@@ -917,8 +1602,7 @@ def add_item():
         session['quote_list'].append(new_item)
         logger.info(f"[ADD_ITEM] Session {session.sid[-6:]} added part {new_item['ID']}")
 
-    update_graph()
-    return jsonify(graph_to_json())
+    return solve_quote()
 
 @app.route("/api/remove_item", methods=["POST"])
 def remove_item():
@@ -935,8 +1619,7 @@ def remove_item():
     session['quote_list'] = new_quote_list
     logger.info(f"[REMOVE_ITEM] Session {session.sid[-6:]} removed part {item_to_remove}")
     session.modified = True
-    update_graph()
-    return jsonify(graph_to_json())
+    return solve_quote()
 
 @app.route("/api/parts")
 def get_all_parts():
@@ -951,22 +1634,92 @@ def load_pdf():
     file = request.files["file"]
     if file.filename == "":
         return jsonify({"error": "No selected file"}), 400
+    # Clients that can follow a job ask for one; small uploads are answered directly
+    if request.values.get("job") == "1":
+        file_bytes = file.read()
+        file.seek(0)
+        if len(file_bytes) >= JOB_MIN_BYTES:
+            job = submit_quote_job(file, file_bytes)
+            if job is None:
+                return jsonify({"error": "Too many quotes loading, try again shortly"}), 503
+            return jsonify({"job": job.id, "status": f"/api/jobs/{job.id}",
+                            "events": f"/api/jobs/{job.id}/events"}), 202
     session['quote_list'] = extract_from_pdf(file)
-    update_graph()
-    return jsonify(graph_to_json())
+    return solve_quote()
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    A load job's status and stage events. The first request after it is done
+    loads its quote into the session; done jobs also return the graph.
+    """
+    job = read_job(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    del job['session']
+    if job['status'] != 'done':
+        return jsonify(job)
+    if not job['applied']:
+        with open(job_path(job_id, '.pickle'), 'rb') as f:
+            result = pickle.load(f)
+        # Another worker may have run the job, so hand its solve to this one's cache
+        solve_cache.put(result['inputs'], result['entry'])
+        session['quote_list'] = result['quote']['quote_list']
+        session['active_status'].update(result['quote']['active_status'])
+        session['next_uid'] = max(session['next_uid'], result['quote']['next_uid'])
+        job['applied'] = True
+        write_job_file(job_path(job_id, '.json'), json.dumps(dict(job, session=session.sid)).encode())
+    session.modified = True
+    with quote_state().lock:
+        state = solved_state()
+        job['graph'] = dict(state.payload, version=state.version)
+    return jsonify(job)
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Server-Sent Events for a load job: a progress event per finished stage,
+    then a done or error event. Fetch /api/jobs/<id> afterwards for the graph.
+    The stream ends after JOB_STREAM_IDLE_SECONDS without an event; progress
+    events carry ids, so a reconnecting client resumes after Last-Event-ID.
+    """
+    if read_job(job_id) is None:
+        return jsonify({"error": "No such job"}), 404
+    path = job_path(job_id, '.json')
+    resume = request.headers.get('Last-Event-ID', '')
+    first = int(resume) if resume.isdigit() else 0
+
+    def stream():
+        sent = first
+        last_event = last_write = time.time()
+        while time.time() - last_event < JOB_STREAM_IDLE_SECONDS:
+            try:
+                job = read_job_file(path)
+            except (OSError, ValueError):
+                break
+            for n, event in enumerate(job['events'][sent:], sent + 1):
+                yield f"id: {n}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+                last_event = last_write = time.time()
+            sent = max(sent, len(job['events']))
+            if job['status'] in ('done', 'error'):
+                yield f"event: {job['status']}\ndata: {json.dumps({'error': job['error']})}\n\n"
+                return
+            # Comment lines keep proxies from closing a quiet stream
+            if time.time() - last_write > 15:
+                yield ": waiting\n\n"
+                last_write = time.time()
+            time.sleep(JOB_POLL_SECONDS)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/clear", methods=["POST"])
 def clear_quote():
     try:
-        session['quote_network'] = []
-        session['warnings_list'] = []
         session['next_uid'] = 1
         session['active_status'] = {}
         session['quote_list'] = []
-        session['graph'] = []
-        session.modified = True
-        update_graph()
-        return jsonify(graph_to_json())
+        return solve_quote()
     except Exception as e:
         return jsonify({"error": "Failed to clear quote", "message": str(e)}), 500
 
@@ -1016,10 +1769,15 @@ def suggest_parts():
     data = request.json
     node_name = data.get("node_name")
     suggestion_type = data.get("suggestion_type", "all parts")
-    node_item = next((x for x in session['quote_network'] if x['Name'] == node_name), None)
+    with quote_state().lock:
+        quote_network = solved_state().network
+    node_item = next((x for x in quote_network if x['Name'] == node_name), None)
     if not node_item:
         return jsonify({"suggestions": {}})
+    return jsonify({"suggestions": slot_suggestions(node_item, suggestion_type)})
 
+def slot_suggestions(node_item, suggestion_type="all parts"):
+    """Catalog parts that fit each of the node's open slots, by slot name."""
     open_slots = []
     for slot in node_item['Slots']:
         if suggestion_type == "all parts":
@@ -1033,22 +1791,14 @@ def suggest_parts():
     for open_slot in open_slots:
         slot_key = open_slot['Name']
         suggestions_by_slot.setdefault(slot_key, set())
-        open_slot_names = open_slot['Name'].split('|')
         needed_type = 'Plug' if open_slot['Type'] == 'Host' else 'Host'
-        for part in part_db:
-            for s in part['Slots']:
-                slot_names = s['Name'].split('|')
-                if s['Type'] == needed_type and any(x in slot_names for x in open_slot_names):
-                    suggestions_by_slot[slot_key].add((part['ID'], part['Name']))
+        suggestions_by_slot[slot_key] |= part_db.compatible_parts(open_slot['Name'], needed_type)
 
-    suggestions_by_slot = {
+    return {
         k: [{"ID": tup[0], "Name": tup[1]} for tup in suggestions_by_slot[k]]
         for k in suggestions_by_slot
     }
 
-    
-    return jsonify({"suggestions": suggestions_by_slot})
-
 @app.route("/api/toggle_item", methods=["POST"])
 def toggle_item():
     data = request.json
@@ -1068,8 +1818,7 @@ def toggle_item():
             session['quote_list'].append(moved_item)
             break
 
-    update_graph()
-    return jsonify(graph_to_json())
+    return solve_quote()
 
 @app.route("/api/connect_custom", methods=["POST"])
 def connect_custom():
@@ -1084,8 +1833,10 @@ def connect_custom():
          return jsonify({"error": "Missing parameters", "data": data}), 400
 
     # Look up nodes by name as in suggest_parts
-    source_node = next((x for x in session['quote_network'] if x['Name'] == source_node_name), None)
-    target_node = next((x for x in session['quote_network'] if x['Name'] == target_node_name), None)
+    with quote_state().lock:
+        quote_network = solved_state().network
+    source_node = next((x for x in quote_network if x['Name'] == source_node_name), None)
+    target_node = next((x for x in quote_network if x['Name'] == target_node_name), None)
     if not source_node or not target_node:
          return jsonify({"error": "Could not find source or target node by name"}), 400
 
@@ -1148,21 +1899,75 @@ def connect_custom():
          session["custom_slots"].append({"ID": missing_node_id, "slot": custom_slot_str})
 
     # Rebuild the graph so the new custom slot is appended to the part's slot list.
-    update_graph()
-    return jsonify(graph_to_json())
+    return solve_quote()
+
+class PrebuiltTemplates:
+    """
+    The prebuilt systems of an Excel file, one per sheet, as (quantity, ID,
+    description) rows. The file is read once and again only when its mtime or
+    the catalog changes. Each read also pre-solves every template into
+    solve_cache on a background thread, so loading a standard system is a hit.
+    """
+    def __init__(self, file):
+        self.file = file
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._templates = {}
+
+    def templates(self):
+        """{name: rows} of every template, re-read if the file changed."""
+        try:
+            stamp = (os.stat(self.file).st_mtime_ns, part_db.version)
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    self._templates = self._read()
+                except Exception as e:
+                    print("Error reading prebuilds:", e)
+                    return {}
+                self._stamp = stamp
+                if WARM_PREBUILTS:
+                    threading.Thread(target=self.presolve, args=(self._templates,), daemon=True).start()
+            return self._templates
+
+    def _read(self):
+        templates = {}
+        for name, df in pd.read_excel(self.file, sheet_name=None).items():
+            if "Product Code" not in df:
+                logger.warning(f"[PREBUILT] Sheet '{name}' has no Product Code column")
+                continue
+            quantities = df["Quantity"] if "Quantity" in df else [1] * len(df)
+            descriptions = df["Description"] if "Description" in df else [""] * len(df)
+            rows = []
+            for code, qty, desc in zip(df["Product Code"], quantities, descriptions):
+                part_id = str(code)
+                # Find description from part_db if missing
+                if not desc or pd.isna(desc):
+                    match = part_db.get(part_id)
+                    desc = match["Name"] if match else part_id
+                rows.append((1 if pd.isna(qty) else int(qty), part_id, desc))
+            templates[name] = rows
+        return templates
+
+    def presolve(self, templates):
+        """Solve every template as load_prebuilt would and store it in solve_cache."""
+        started = time.perf_counter()
+        for rows in templates.values():
+            quote = {'quote_list': [], 'active_status': {}, 'next_uid': 0, 'custom_slots': []}
+            quote['quote_list'] = quote_line_items(quote, rows)
+            solve_and_cache(QuoteState(), quote)
+        logger.info(f"[PREBUILT] Pre-solved {len(templates)} templates in {time.perf_counter() - started:.2f}s")
+
+# Set WARM_PREBUILTS=0 to skip pre-solving, e.g. for offline tools
+WARM_PREBUILTS = os.environ.get("WARM_PREBUILTS", "1") != "0"
+prebuilt_templates = PrebuiltTemplates(PREBUILT_FILE)
 
 @app.route("/api/prebuilts", methods=["GET"])
 def get_prebuilts():
     """Return only Excel-defined prebuilts (global templates)."""
-    prebuilts = []
-    try:
-        if os.path.exists(PREBUILT_FILE):
-            xls = pd.ExcelFile(PREBUILT_FILE)
-            prebuilts = xls.sheet_names
-    except Exception as e:
-        print("Error reading prebuilds:", e)
-
-    return jsonify({"prebuilts": sorted(prebuilts)})
+    return jsonify({"prebuilts": sorted(prebuilt_templates.templates())})
 
 
 @app.route("/api/load_prebuilt", methods=["POST"])
@@ -1174,48 +1979,19 @@ def load_prebuilt():
         return jsonify({"error": "No name provided"}), 400
 
     # --- Try Excel first ---
-    if os.path.exists(PREBUILT_FILE):
-        try:
-            xl = pd.ExcelFile(PREBUILT_FILE)
-            if name in xl.sheet_names:
-                df = pd.read_excel(PREBUILT_FILE, sheet_name=name)
-                session["quote_list"] = []
-                session["next_uid"] = 0
-                session["active_status"] = {}
-
-                for _, row in df.iterrows():
-                    part_id = str(row["Product Code"])
-                    qty = int(row["Quantity"]) if "Quantity" in row and not pd.isna(row["Quantity"]) else 1
-
-                    # Find description from part_db if missing
-                    desc = row.get("Description", "")
-                    if not desc or pd.isna(desc):
-                        match = next((p["Name"] for p in part_db if p["ID"] == part_id), part_id)
-                        desc = match
-
-                    for _ in range(qty):
-                        uid = session["next_uid"]
-                        session["next_uid"] += 1
-                        session["active_status"][uid] = True
-                        session["quote_list"].append({
-                            "ID": part_id,
-                            "Description": desc,
-                            "active": True,
-                            "uid": uid
-                        })
-
-                update_graph()
-                return jsonify(graph_to_json())
-        except Exception as e:
-            print("Excel load failed:", e)
+    template = prebuilt_templates.templates().get(name)
+    if template is not None:
+        session["next_uid"] = 0
+        session["active_status"] = {}
+        session["quote_list"] = quote_line_items(session, template)
+        return solve_quote()
 
     # --- Fall back to session prebuilts ---
     if "session_prebuilts" in session and name in session["session_prebuilts"]:
         session["quote_list"] = list(session["session_prebuilts"][name])
         session["next_uid"] = 0
         session["active_status"] = {}
-        update_graph()
-        return jsonify(graph_to_json())
+        return solve_quote()
 
     return jsonify({"error": f"Prebuilt '{name}' not found"}), 404
 
@@ -1259,8 +2035,7 @@ def load_session_prebuilt():
     session["quote_list"] = list(session_prebuilts[name])
     session["next_uid"] = 0
     session["active_status"] = {}
-    update_graph()
-    return jsonify(graph_to_json())
+    return solve_quote()
 
 @app.route("/api/delete_prebuilt_session", methods=["POST"])
 def delete_prebuilt_session():
@@ -1277,20 +2052,6 @@ def delete_prebuilt_session():
     session.modified = True
     return jsonify({"success": True, "message": f"Deleted template '{name}'"})
 
-if __name__ == "__main__":
-    # Run only in local dev
-    print("Running locally, building partdb...")
-    try:
-        if os.path.exists("JBAMdb.xlsx"):
-            build_partdb("JBAMdb.xlsx")
-            print("✅ build_partdb succeeded", flush=True)
-        else:
-            print("⚠️ JBAMdb.xlsx not found — skipping build_partdb()", flush=True)
-    except Exception as e:
-        print(f"❌ build_partdb failed: {e}", flush=True)
-    port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port)
-
 @app.route("/")
 def index():
     return send_from_directory(app.static_folder, "index.html")
@@ -1309,4 +2070,12 @@ def serve_frontend(path):
     else:
         return send_from_directory(build_dir, "index.html")
 
-build_partdb('JBAMdb.xlsx')
\ No newline at end of file
+# Load the catalog at import so every gunicorn worker has it, then read and
+# pre-solve the prebuilt templates
+load_catalog("JBAMdb.xlsx")
+prebuilt_templates.templates()
+
+if __name__ == "__main__":
+    # Run only in local dev
+    port = int(os.environ.get("PORT", 8080))
+    app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,188 @@
+"""
+Benchmark catalog parsing, the solver (update_graph), the serializer
+(graph_to_json) and the part suggestions over quotes of many sizes.
+
+    python benchmark.py [--sizes 10,100] [--repeat 5] [--save-baseline FILE]
+    python benchmark.py --baseline FILE [--threshold 0.25]
+
+Quotes are synthetic ones sampled from catalog parts that have slots (plain,
+ghost-heavy and interlock-heavy mixes), every prebuilds.xlsx system and the
+bundled TI2U.pdf. Each stage reports latency percentiles over the repeats and
+its peak traced memory. --save-baseline stores the results; --baseline compares
+against stored results and exits with status 1 when a stage's median time or
+peak memory grew by more than the threshold. Ghost- and interlock-heavy
+quotes of 1000 items take seconds per solve, so the default sizes stop at 100;
+pass --sizes 10,100,1000 for the full sweep.
+"""
+import argparse, contextlib, io, json, os, random, sys, time, tracemalloc, warnings
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+import solver, validate_quotes
+
+MIXES = ['mixed', 'ghost', 'interlock']
+STAGES = ['solve', 'serialize', 'suggest']
+# Differences below these are noise, whatever the ratio
+MIN_DELTA_MS = 2.0
+MIN_DELTA_KIB = 64
+app = None
+
+def percentile(values, q):
+    """The q-th percentile of values, interpolating between ranks."""
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def synthetic_quote(mix, size, rng):
+    """
+    size line items drawn from catalog parts with slots. Ghost and interlock
+    mixes draw half of them from parts that spawn AddParts or carry a tag the
+    tagged network pass solves.
+    """
+    slotted = [p for p in app.part_db if p['Slots']]
+    heavy = {
+        'mixed': slotted,
+        'ghost': [p for p in app.part_db if p.get('AddPart')],
+        'interlock': [p for p in slotted if any(tag in p['Tags'] for tag in solver.EXCLUDE_TAGS)],
+    }[mix]
+    parts = [rng.choice(heavy) if rng.random() < 0.5 else rng.choice(slotted) for _ in range(size)]
+    return [(1, p['ID'], p['Name']) for p in parts]
+
+def benchmark_quotes(sizes, seed=0):
+    """(name, rows) for every quote the benchmark runs."""
+    rng = random.Random(seed)
+    quotes = [(f'synthetic-{mix}-{size}', synthetic_quote(mix, size, rng)) for size in sizes for mix in MIXES]
+    if os.path.exists(app.PREBUILT_FILE):
+        for name, df in pd.read_excel(app.PREBUILT_FILE, sheet_name=None).items():
+            rows = []
+            for code, qty, desc in zip(df['Product Code'], df.get('Quantity', [1] * len(df)), df.get('Description', [''] * len(df))):
+                rows.append((1 if pd.isna(qty) else int(qty), str(code), '' if pd.isna(desc) else str(desc)))
+            quotes.append((f'prebuilt-{name}', rows))
+    with open('TI2U.pdf', 'rb') as f:
+        quotes.append(('pdf-TI2U', app.read_quote_file(FileStorage(f, filename='TI2U.pdf'))))
+    return quotes
+
+def run_stages(rows):
+    """Run every stage once on a fresh quote, returning {stage: seconds}."""
+    quote = {'quote_list': [], 'active_status': {}, 'next_uid': 1, 'custom_slots': []}
+    quote['quote_list'] = app.quote_line_items(quote, rows)
+    state = app.QuoteState()
+    timings = {}
+    started = time.perf_counter()
+    app.update_graph(state, quote)
+    timings['solve'] = time.perf_counter() - started
+    started = time.perf_counter()
+    app.graph_to_json(state, quote)
+    timings['serialize'] = time.perf_counter() - started
+    started = time.perf_counter()
+    for node_item in state.network:
+        app.slot_suggestions(node_item)
+    timings['suggest'] = time.perf_counter() - started
+    return timings
+
+def traced_peaks(rows):
+    """Peak traced memory (KiB) of each stage, from one extra run under tracemalloc."""
+    quote = {'quote_list': [], 'active_status': {}, 'next_uid': 1, 'custom_slots': []}
+    quote['quote_list'] = app.quote_line_items(quote, rows)
+    state = app.QuoteState()
+    stages = {
+        'solve': lambda: app.update_graph(state, quote),
+        'serialize': lambda: app.graph_to_json(state, quote),
+        'suggest': lambda: [app.slot_suggestions(node_item) for node_item in state.network],
+    }
+    peaks = {}
+    tracemalloc.start()
+    for stage in STAGES:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        stages[stage]()
+        peaks[stage] = (tracemalloc.get_traced_memory()[1] - before) / 1024
+    tracemalloc.stop()
+    return peaks
+
+def summarize(seconds, peak_kib):
+    ms = [s * 1000 for s in seconds]
+    return {
+        'runs': len(ms),
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p90_ms': round(percentile(ms, 90), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'max_ms': round(max(ms), 3),
+        'peak_kib': round(peak_kib, 1),
+    }
+
+def benchmark_catalog(repeat):
+    """Time parsing the real catalog from JBAMdb.xlsx (not the snapshot)."""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        app.build_partdb('JBAMdb.xlsx')
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    app.build_partdb('JBAMdb.xlsx')
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return summarize(seconds, peak)
+
+def compare(results, baseline, threshold):
+    """Descriptions of every stage that regressed past the threshold."""
+    regressions = []
+    for key, base in baseline.items():
+        now = results.get(key)
+        if now is None:
+            continue
+        if now['p50_ms'] > base['p50_ms'] * (1 + threshold) and now['p50_ms'] - base['p50_ms'] > MIN_DELTA_MS:
+            regressions.append(f"{key}: p50 {base['p50_ms']:.2f} -> {now['p50_ms']:.2f} ms")
+        if now['peak_kib'] > base['peak_kib'] * (1 + threshold) and now['peak_kib'] - base['peak_kib'] > MIN_DELTA_KIB:
+            regressions.append(f"{key}: peak {base['peak_kib']:.0f} -> {now['peak_kib']:.0f} KiB")
+    return regressions
+
+def main(argv=None):
+    global app
+    parser = argparse.ArgumentParser(description="Benchmark the quote solver and serializer.")
+    parser.add_argument('--sizes', default='10,100', help="comma-separated synthetic quote sizes")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per quote")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic quotes")
+    parser.add_argument('--save-baseline', metavar='FILE', help="write the results as a baseline")
+    parser.add_argument('--baseline', metavar='FILE', help="fail on regressions against this baseline")
+    parser.add_argument('--threshold', type=float, help="allowed slowdown/growth ratio (default: the baseline's, or 0.25)")
+    args = parser.parse_args(argv)
+    save_baseline = args.save_baseline and os.path.abspath(args.save_baseline)
+    baseline_file = args.baseline and os.path.abspath(args.baseline)
+
+    validate_quotes.load_app()
+    app = validate_quotes.app
+
+    # Keep the catalog's style warnings and prints out of the report
+    warnings.filterwarnings('ignore', module='openpyxl')
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {'catalog/parse': benchmark_catalog(min(args.repeat, 3))}
+        for name, rows in benchmark_quotes([int(s) for s in args.sizes.split(',')], args.seed):
+            runs = [run_stages(rows) for _ in range(args.repeat)]
+            peaks = traced_peaks(rows)
+            for stage in STAGES:
+                results[f'{name}/{stage}'] = summarize([run[stage] for run in runs], peaks[stage])
+
+    print(f"{'benchmark':<40}{'runs':>5}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}{'max ms':>11}{'peak KiB':>11}")
+    for key, r in results.items():
+        print(f"{key:<40}{r['runs']:>5}{r['p50_ms']:>11.2f}{r['p90_ms']:>11.2f}{r['p99_ms']:>11.2f}{r['max_ms']:>11.2f}{r['peak_kib']:>11.0f}")
+
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            json.dump({'threshold': args.threshold or 0.25, 'results': results}, f, indent=1)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        threshold = args.threshold if args.threshold is not None else baseline.get('threshold', 0.25)
+        regressions = compare(results, baseline['results'], threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {threshold:.0%}:", *regressions, sep="\n  ")
+            return 1
+        print(f"No regressions beyond {threshold:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,12 @@
+# Gunicorn settings, picked up automatically when gunicorn starts in this folder.
+# Each session's solved graph lives in its own locked QuoteState, so requests
+# from different users can share a worker's threads. One worker by default:
+# catalog, solve cache, region caches and patch bases are per process, so a
+# session's requests all land where its state is.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = 120
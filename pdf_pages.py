@@ -0,0 +1,8 @@
+# Page text extraction run by app.py's PDF process pool. Kept apart from app.py
+# so pool processes import only PyMuPDF, not the app, its catalog or its threads.
+import fitz
+
+def pdf_page_texts(file_bytes, page_numbers):
+    """The text of every block on the given pages, one list per page."""
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        return [[block[4] for block in doc[n].get_text_blocks()] for n in page_numbers]
@@ -0,0 +1,548 @@
+# The region solver: scoring slot pairs and connecting them on a compact slot
+# table. Kept apart from app.py, which it does not import, so the solve pool's
+# processes can run solve_region_task without loading the app or its catalog.
+import os, time, random
+import numpy as np
+import networkx as nx
+from collections import defaultdict
+from functools import lru_cache
+from itertools import combinations
+
+# Skip all parts with this tag in initial connection pass
+EXCLUDE_TAGS = ['Interlock','LaserSafety','NiLayer','Triggering','BNC']
+# Need to check each of these for total connection
+CHECK_TAGS = ['LaserSafety','NiLayer','Triggering']
+
+# Custom arrows for visualization
+CUSTOM_ARROWS = {'InterlockPhone':'InterlockPhone.svg','InterlockRound':'InterlockRound.svg','InterlockPhoneLSC':'InterlockPhone.svg','InterlockRoundLSC':'InterlockRound.svg','InterlockPlug':'InterlockPlug.svg','InterlockLUNF':'InterlockLUNF.svg','BNC':'BNC.svg','BNCBB':'BNC.svg'}
+
+# Pass 1 connects pairs greedily in score order, or with PASS1_ENGINE=flow picks
+# them by min-cost flow first so required slots get filled (see flow_assignment)
+PASS1_ENGINE = os.environ.get("PASS1_ENGINE", "greedy")
+
+class SolveProfile:
+    """
+    Timings (seconds per stage), sizes and pass 2 search steps (per check tag)
+    of one solve, for the [SOLVE] log line and /api/metrics. on_stage, if
+    given, is called with each stage name the first time it finishes, so
+    stages that run once per region are reported once per solve.
+    """
+    def __init__(self, on_stage=None):
+        self.seconds = defaultdict(float)
+        self.sizes = {}
+        self.steps = defaultdict(int)
+        self.on_stage = on_stage
+
+    def add(self, stage, started):
+        """Add the time since started to stage and return the current time."""
+        now = time.perf_counter()
+        first = stage not in self.seconds
+        self.seconds[stage] += now - started
+        if first and self.on_stage is not None:
+            self.on_stage(stage)
+            now = time.perf_counter()
+        return now
+
+    def merge(self, other):
+        """Add the stage timings and search steps of another profile, e.g. a pool worker's."""
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+        for tag, steps in other.steps.items():
+            self.steps[tag] += steps
+
+    def fields(self):
+        """The profile as key=value log fields."""
+        fields = [f"{k}={v}" for k, v in self.sizes.items()]
+        fields += [f"{stage}_ms={seconds * 1000:.2f}" for stage, seconds in self.seconds.items()]
+        fields += [f"pass2_{tag}_steps={steps}" for tag, steps in self.steps.items()]
+        return " ".join(fields)
+
+# A tiny Union–Find (Disjoint‐Set) for part‐UIDs:
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+        self.rank = {}
+
+    def make_set(self, x):
+        if x not in self.parent:
+            self.parent[x] = x
+            self.rank[x] = 0
+
+    def find(self, x):
+        # path compression
+        if self.parent[x] != x:
+            self.parent[x] = self.find(self.parent[x])
+        return self.parent[x]
+
+    def union(self, x, y):
+        rootx = self.find(x)
+        rooty = self.find(y)
+        if rootx == rooty:
+            return False
+        # union by rank
+        if self.rank[rootx] < self.rank[rooty]:
+            self.parent[rootx] = rooty
+        elif self.rank[rootx] > self.rank[rooty]:
+            self.parent[rooty] = rootx
+        else:
+            self.parent[rooty] = rootx
+            self.rank[rootx] += 1
+        return True
+
+class SlotTable:
+    """
+    Compact solver state for one region. The region's slots are positions
+    0..n-1 in parallel lists (owning part, capacity, Min, host flag), and its parts
+    are positions in `parts`, the sorted network indices. Slot occupancy is a
+    flat fill count per slot and each part keeps the set of parts it is linked
+    to, so checking a pair is O(1). Connections are made and undone in order;
+    the Status lists are only built from them at the end.
+    """
+    __slots__ = ('parts', 'part', 'capacity', 'required', 'host', 'active', 'key', 'uids',
+                 'fill', 'linked', 'connections')
+
+    def __init__(self, quote_network, slot_list):
+        self.parts = sorted({s['Index'] for s in slot_list})
+        local = {index: p for p, index in enumerate(self.parts)}
+        self.part = [local[s['Index']] for s in slot_list]
+        self.capacity = [int(s['Max']) for s in slot_list]
+        self.required = [max(0, min(int(s['Min']), int(s['Max']))) for s in slot_list]
+        self.host = [s['Type'] == 'Host' for s in slot_list]
+        self.active = [bool(quote_network[index]['active']) for index in self.parts]
+        self.uids = [quote_network[index]['uid'] for index in self.parts]
+        # Parts are linked by uid, so parts sharing one count as the same part
+        keys = {}
+        self.key = [keys.setdefault(uid, len(keys)) for uid in self.uids]
+        self.fill = [0] * len(slot_list)
+        self.linked = [set() for _ in self.parts]
+        self.connections = []
+
+    def can_connect(self, i, j):
+        p1, p2 = self.part[i], self.part[j]
+        return (self.active[p1] and self.active[p2] and self.host[i] != self.host[j]
+                and self.fill[i] < self.capacity[i] and self.fill[j] < self.capacity[j]
+                and self.key[p1] not in self.linked[p2] and self.key[p2] not in self.linked[p1])
+
+    def connect(self, i, j):
+        p1, p2 = self.part[i], self.part[j]
+        self.fill[i] += 1
+        self.fill[j] += 1
+        self.linked[p1].add(self.key[p2])
+        self.linked[p2].add(self.key[p1])
+        self.connections.append((i, j))
+
+    def disconnect(self):
+        i, j = self.connections.pop()
+        p1, p2 = self.part[i], self.part[j]
+        self.fill[i] -= 1
+        self.fill[j] -= 1
+        self.linked[p1].discard(self.key[p2])
+        self.linked[p2].discard(self.key[p1])
+
+    def statuses(self):
+        """Each slot's Status list: the uids of the parts it connects to, in order."""
+        status = [[] for _ in self.part]
+        for i, j in self.connections:
+            status[i].append(self.uids[self.part[j]])
+            status[j].append(self.uids[self.part[i]])
+        return status
+
+def solve_tagged_network(table, pairs, terminals, search_budget=2000):
+    """
+    Decide which candidate slot pairs to connect for one check tag, connecting
+    them in table.
+
+    Parts linked by candidate pairs form groups. In every group holding two or
+    more terminals (table part positions), a spanning tree over the terminals is
+    built first: Kruskal over the pairs in order, then, if that leaves terminals
+    apart and the free slots still allow a tree, a bounded depth-first search. Remaining pairs are connected
+    afterwards wherever slots are still free. Returns the ordered connections,
+    whether all terminals ended up in one network, and how many steps the
+    depth-first search took.
+    """
+    first = len(table.connections)
+    steps = 0
+    pair_key = random.Random(len(pairs))
+    part_of = table.part.__getitem__
+    can_connect = table.can_connect
+    connect = table.connect
+    disconnect = table.disconnect
+
+    def span(group_pairs, group_terminals):
+        tree = UnionFind()
+        for i, j in group_pairs:
+            tree.make_set(part_of(i))
+            tree.make_set(part_of(j))
+        added = 0
+        for i, j in group_pairs:
+            if tree.find(part_of(i)) != tree.find(part_of(j)) and can_connect(i, j):
+                connect(i, j)
+                tree.union(part_of(i), part_of(j))
+                added += 1
+        root = tree.find(group_terminals[0])
+        if all(tree.find(t) == root for t in group_terminals):
+            return True
+        for _ in range(added):
+            disconnect()
+        return False
+
+    def feasible(group_pairs, group_terminals):
+        # Connecting only uses up slots, so two checks on the slots free now can
+        # rule a tree out before searching. Every terminal must be reachable from
+        # the first through parts with two free slot units to pass a connection
+        # on, and every other terminal hangs from a slot unit of its own on a
+        # neighbour, so terminals that can only use the same few slots must not
+        # outnumber their free units
+        free = defaultdict(int)
+        for k in {k for pair in group_pairs for k in pair}:
+            free[part_of(k)] += table.capacity[k] - table.fill[k]
+        neighbours = defaultdict(list)
+        parents = defaultdict(set)
+        targets = set(group_terminals[1:])
+        for i, j in group_pairs:
+            if not can_connect(i, j):
+                continue
+            neighbours[part_of(i)].append(part_of(j))
+            neighbours[part_of(j)].append(part_of(i))
+            for k, other in ((i, j), (j, i)):
+                if part_of(k) in targets:
+                    parents[part_of(k)].add(other)
+        root = group_terminals[0]
+        found = {root}
+        queue = [root]
+        while queue:
+            p = queue.pop()
+            if p != root and free[p] < 2:
+                continue
+            for q in neighbours[p]:
+                if q not in found:
+                    found.add(q)
+                    queue.append(q)
+        if not targets <= found:
+            return False
+        choices = {frozenset(slots) for slots in parents.values()}
+        for slots in choices:
+            units = sum(table.capacity[k] - table.fill[k] for k in slots)
+            if sum(parents[t] <= slots for t in targets) > units:
+                return False
+        return True
+
+    def search(group_pairs, group_terminals):
+        # Grow a tree outward from the first terminal, backtracking on dead ends
+        nonlocal steps
+        if not feasible(group_pairs, group_terminals):
+            return False
+        targets = set(group_terminals)
+        reached = [group_terminals[0]]
+        inside = np.zeros(len(table.parts), dtype=bool)
+        inside[group_terminals[0]] = True
+        missing = len(targets) - 1
+        # Trees already tried, as an XOR of random keys of their pairs
+        keys = [pair_key.getrandbits(64) for _ in group_pairs]
+        grown = 0
+        seen = set()
+        budget = search_budget
+        pair_parts = np.array([(part_of(i), part_of(j)) for i, j in group_pairs], dtype=np.intp).reshape(-1, 2)
+        # Pairs that cannot connect now never will further down
+        incident = defaultdict(list)
+        for k, (p1, p2) in enumerate(pair_parts.tolist()):
+            if can_connect(*group_pairs[k]):
+                incident[p1].append(k)
+                incident[p2].append(k)
+        incident = {p: np.array(ks, dtype=np.intp) for p, ks in incident.items()}
+        pair_slots = np.array(group_pairs, dtype=np.intp).reshape(-1, 2)
+        room = np.array(table.capacity) - np.array(table.fill)
+
+        def frontier(previous, part):
+            # Pairs with exactly one part inside the tree, in pair order: the
+            # new part's pairs leave the frontier or join it. Slots only fill up
+            # further down, so pairs without room are dropped for good
+            touching = incident.get(part, previous[:0])
+            other = pair_parts[touching].sum(axis=1) - part
+            pairs = np.union1d(np.setdiff1d(previous, touching, assume_unique=True), touching[~inside[other]])
+            return pairs[(room[pair_slots[pairs, 0]] > 0) & (room[pair_slots[pairs, 1]] > 0)]
+
+        # Each frame: its frontier, the next position in it, and the pair that opened it
+        frames = [[frontier(np.zeros(0, dtype=np.intp), reached[0]), 0, None]]
+        while frames:
+            if not missing:
+                return True
+            frame = frames[-1]
+            if frame[1] == len(frame[0]) or budget <= 0:
+                frames.pop()
+                if frames:
+                    disconnect()
+                    grown ^= keys[frame[2]]
+                    room[list(group_pairs[frame[2]])] += 1
+                    part = reached.pop()
+                    inside[part] = False
+                    missing += part in targets
+                continue
+            k = int(frame[0][frame[1]])
+            frame[1] += 1
+            if grown ^ keys[k] in seen:
+                continue
+            i, j = group_pairs[k]
+            if not can_connect(i, j):
+                continue
+            connect(i, j)
+            room[[i, j]] -= 1
+            grown ^= keys[k]
+            seen.add(grown)
+            budget -= 1
+            steps += 1
+            part = part_of(j) if inside[part_of(i)] else part_of(i)
+            reached.append(part)
+            inside[part] = True
+            missing -= part in targets
+            frames.append([frontier(frame[0], part), 0, k])
+        return False
+
+    groups = UnionFind()
+    for p in range(len(table.parts)):
+        groups.make_set(p)
+    for i, j in pairs:
+        if can_connect(i, j):
+            groups.union(part_of(i), part_of(j))
+    terminals_by_group = defaultdict(list)
+    for t in terminals:
+        terminals_by_group[groups.find(t)].append(t)
+
+    for group, group_terminals in terminals_by_group.items():
+        if len(group_terminals) < 2:
+            continue
+        group_pairs = [(i, j) for i, j in pairs if groups.find(part_of(i)) == group]
+        if not span(group_pairs, group_terminals):
+            search(group_pairs, group_terminals)
+
+    # Use up whatever connections are still possible
+    for i, j in pairs:
+        if can_connect(i, j):
+            connect(i, j)
+
+    connections = table.connections[first:]
+    network = UnionFind()
+    for t in terminals:
+        network.make_set(t)
+    for i, j in connections:
+        network.make_set(part_of(i))
+        network.make_set(part_of(j))
+        network.union(part_of(i), part_of(j))
+    valid = len({network.find(t) for t in terminals}) <= 1
+    return connections, valid, steps
+
+@lru_cache(maxsize=None)
+def slot_tokens(slot_name):
+    # Slot names list interchangeable connectors separated by '|'
+    return frozenset(slot_name.split('|'))
+
+def index_slot_tokens(slot_list, indices):
+    """Bucket slot_list positions by slot-name token."""
+    buckets = defaultdict(list)
+    for i in indices:
+        for token in slot_tokens(slot_list[i]['Name']):
+            buckets[token].append(i)
+    return buckets
+
+def score_slot_pairs(quote_network, slot_list, exclude_tags):
+    """
+    Find the slot pairs of the quote that can connect and return them as [i, j]
+    pairs (i < j) in connection order: decreasing score, then increasing
+    distance between parts. Candidates come from a hash join on name tokens: a
+    Host and a non-Host slot sharing a token, on different parts that do not
+    both carry the same excluded tag or both belong to the interlock /
+    triggering families. Pairs start at 1 point, plus 6/3 when both/one slot is
+    required (Min > 0) and 2/1 when both/one belongs to a user-added part.
+    Pairs that are the only candidate in their row or column (singletons) get
+    10 more.
+    """
+    n = len(slot_list)
+    hosts = defaultdict(list)
+    plugs = defaultdict(list)
+    for i, slot in enumerate(slot_list):
+        side = hosts if slot['Type'] == 'Host' else plugs
+        for token in slot_tokens(slot['Name']):
+            side[token].append(i)
+    candidates = set()
+    for token, host_slots in hosts.items():
+        for j in plugs.get(token, ()):
+            candidates.update((i, j) if i < j else (j, i) for i in host_slots)
+    if not candidates:
+        return []
+    pairs = np.array(sorted(candidates), dtype=np.intp)
+
+    tag_bit = {tag: 1 << k for k, tag in enumerate(exclude_tags)}
+    laser_bits = tag_bit.get('Interlock', 0) | tag_bit.get('LaserSafety', 0)
+    trigger_bits = tag_bit.get('BNC', 0) | tag_bit.get('Triggering', 0)
+    part_tags = {index: sum(tag_bit[t] for t in set(quote_network[index]['Tags']) if t in tag_bit)
+                 for index in {slot['Index'] for slot in slot_list}}
+    index = np.array([slot['Index'] for slot in slot_list])
+    required = np.array([slot['Min'] > 0 for slot in slot_list], dtype=np.int64)
+    user_added = np.array([not slot['GhostPart'] for slot in slot_list], dtype=np.int64)
+    tags = np.array([part_tags[slot['Index']] for slot in slot_list], dtype=np.int64)
+
+    # Different parts, and not both carrying the same excluded tag or both
+    # belonging to the interlock / triggering families
+    i, j = pairs[:, 0], pairs[:, 1]
+    valid = index[i] != index[j]
+    valid &= (tags[i] & tags[j]) == 0
+    valid &= ~(((tags[i] & laser_bits) != 0) & ((tags[j] & laser_bits) != 0))
+    valid &= ~(((tags[i] & trigger_bits) != 0) & ((tags[j] & trigger_bits) != 0))
+    i, j = i[valid], j[valid]
+
+    conn_score = 1 + 3 * (required[i] + required[j]) + user_added[i] + user_added[j]
+    # Adding 10 points here is sufficient to make singletons the first to connect
+    singleton = (np.bincount(i, minlength=n)[i] == 1) | (np.bincount(j, minlength=n)[j] == 1)
+    conn_score = conn_score + singleton * 10
+    conn_distance = np.abs(index[i] - index[j])
+
+    order = np.lexsort((j, i, conn_distance, -conn_score))
+    return np.stack((i[order], j[order]), axis=1).tolist()
+
+def flow_assignment(table, pairs):
+    """
+    Choose pass 1 connections among pairs (in connection order) as a min-cost
+    circulation: source -> Host slots -> candidate pairs -> other slots -> sink,
+    with each slot taking at most Max connections. Pair k of m costs k - m, and
+    each unit of a slot's Min that gets filled earns more than all pairs
+    together, so required slots are filled whenever some assignment fills them;
+    after that earlier pairs are preferred. Connecting two parts twice is not modelled, so the
+    caller skips repeats. Returns the chosen pairs as (i, j) tuples.
+    """
+    bonus = len(pairs) * (len(pairs) + 1) // 2 + 1
+    graph = nx.DiGraph()
+    graph.add_edge('sink', 'source', weight=0)
+    slots = set()
+    for rank, (i, j) in enumerate(pairs):
+        if not (table.active[table.part[i]] and table.active[table.part[j]]):
+            continue
+        host, plug = (i, j) if table.host[i] else (j, i)
+        graph.add_edge(('host', host), ('plug', plug), capacity=1, weight=rank - len(pairs))
+        slots.update((host, plug))
+    for k in slots:
+        slot = ('host', k) if table.host[k] else ('plug', k)
+        optional = table.capacity[k] - table.required[k]
+        if table.host[k]:
+            ends = [('source', ('required', k)), (('required', k), slot), ('source', slot)]
+        else:
+            ends = [(slot, ('required', k)), (('required', k), 'sink'), (slot, 'sink')]
+        if table.required[k]:
+            graph.add_edge(*ends[0], capacity=table.required[k], weight=-bonus)
+            graph.add_edge(*ends[1], capacity=table.required[k], weight=0)
+        if optional > 0:
+            graph.add_edge(*ends[2], capacity=optional, weight=0)
+    flow = nx.min_cost_flow(graph)
+    chosen = set()
+    for k in slots:
+        if table.host[k]:
+            for (_, plug), units in flow[('host', k)].items():
+                if units:
+                    chosen.add((k, plug) if k < plug else (plug, k))
+    return chosen
+
+def solve_region(quote_network, slot_list, region, profile):
+    """
+    Run both connection passes over one region. Fills the Status lists of the
+    region's slots and returns the region's solution: the graph edges in the
+    order they were made, the resulting slot statuses, the number of scored
+    pairs, and for each check tag the number of tagged parts in the region and
+    whether they are all joined. Stage timings are added to profile.
+    """
+    region_slots = [slot_list[k] for k in region]
+    n = len(region_slots)
+    table = SlotTable(quote_network, region_slots)
+    edges = []
+
+    # Connect singletons first, then by decreasing score, then by increasing distance between parts
+    started = time.perf_counter()
+    sorted_list = score_slot_pairs(quote_network, region_slots, EXCLUDE_TAGS)
+    started = profile.add('score', started)
+
+    # Pass 1: connect all parts without tags indicated by EXCLUDE_TAGS. The flow
+    # engine's choice goes first, then the greedy pass fills whatever is left.
+    pass1_pairs = sorted_list
+    if PASS1_ENGINE == 'flow':
+        chosen = flow_assignment(table, sorted_list)
+        pass1_pairs = [pair for pair in sorted_list if tuple(pair) in chosen] + sorted_list
+    for i, j in pass1_pairs:
+        # Every candidate shares a name token; skip repeated connections between two parts
+        if table.can_connect(i, j):
+            slot1, slot2 = region_slots[i], region_slots[j]
+            part1 = quote_network[slot1['Index']]
+            part2 = quote_network[slot2['Index']]
+            # This is a directed graph, so we always connect from Host to Plug
+            if table.host[i]:
+                edges.append((part1["Name"], part2["Name"], {'fromSlot': slot1["Name"], 'toSlot': slot2["Name"]}))
+            else:
+                edges.append((part2["Name"], part1["Name"], {'fromSlot': slot2["Name"], 'toSlot': slot1["Name"]}))
+            table.connect(i, j)
+    started = profile.add('pass1', started)
+
+    # Pass 2: connect the networks formed by CHECK_TAGS and check that each is complete
+    tag_networks = {}
+    for tag in CHECK_TAGS:
+
+        # Filter parts relevant to this tag
+        tag_set = {'LaserSafety', 'Interlock'} if tag == "LaserSafety" else {'Triggering', 'BNC'} if tag == "Triggering" else {tag}
+
+        # Only slots sharing a name token can pair, so bucket the tagged slots by token
+        tagged_slots = [i for i in range(n) if tag_set.intersection(quote_network[region_slots[i]['Index']]['Tags'])]
+        candidate_pairs = set()
+        for bucket in index_slot_tokens(region_slots, tagged_slots).values():
+            for i, j in combinations(bucket, 2):
+                part1 = quote_network[region_slots[i]['Index']]
+                part2 = quote_network[region_slots[j]['Index']]
+                if part1 is part2:
+                    continue
+                # Cables only join each other in the laser safety chain
+                if tag not in part1['Tags'] and tag not in part2['Tags']:
+                    if not (tag == 'LaserSafety' and 'Interlock' in part1['Tags'] and 'Interlock' in part2['Tags']):
+                        continue
+                candidate_pairs.add((i, j))
+        interlock_pairs = sorted(candidate_pairs)
+
+        # Every part carrying the tag itself must end up in a single network
+        terminals = [p for p, index in enumerate(table.parts) if tag in quote_network[index]['Tags']]
+        connections, valid_network, steps = solve_tagged_network(table, interlock_pairs, terminals)
+        tag_networks[tag] = (len(terminals), valid_network)
+        profile.steps[tag] += steps
+
+        for i, j in connections:
+            slot1, slot2 = region_slots[i], region_slots[j]
+            part1 = quote_network[slot1['Index']]
+            part2 = quote_network[slot2['Index']]
+            if slot1['Type'] == 'Host':
+                slot1, slot2 = slot2, slot1
+                part1, part2 = part2, part1
+
+            if slot1['Name'] in CUSTOM_ARROWS:
+                edges.append((part2["Name"], part1["Name"], {
+                    'arrows': {
+                        "from": {
+                            "enabled": True,
+                            "type": "image",
+                            "src": f"/images/{CUSTOM_ARROWS[slot1['Name']]}",
+                            "scaleFactor": 1,
+                            "imageWidth": 40,
+                            "imageHeight": 40
+                        },
+                        "to": {"enabled": False},
+                    },
+                    'arrowStrikethrough': False,
+                    'fromSlot': slot1["Name"],
+                    'toSlot': slot2["Name"],
+                }))
+            else:
+                edges.append((part2["Name"], part1["Name"], {'fromSlot': slot1["Name"], 'toSlot': slot2["Name"]}))
+        started = profile.add(f'pass2_{tag}', started)
+
+    status = table.statuses()
+    for slot, slot_status in zip(region_slots, status):
+        quote_network[slot['Index']]['Slots'][slot['Loc']]['Status'] = list(slot_status)
+    return {'edges': edges, 'status': status, 'pairs': len(sorted_list), 'tag_networks': tag_networks}
+
+def solve_region_task(parts, region_slots):
+    """Solve one region in a pool worker, given only its parts by network index."""
+    profile = SolveProfile()
+    result = solve_region(parts, region_slots, range(len(region_slots)), profile)
+    return result, profile
@@ -0,0 +1,112 @@
+"""
+Validate a folder of quote PDFs/CSVs offline, without the web app or a session.
+
+    python validate_quotes.py QUOTE_DIR [-o quote_summary.csv] [-j WORKERS]
+
+Every quote is parsed, solved and slot-checked the same way /api/load_pdf does
+it, and summarized in one row: its missing slots, the interlock/laser safety/
+trigger networks that are not valid, and the system tag warnings. The output is
+CSV, or JSONL when the output file ends in .jsonl. Quotes are spread over a
+process pool and the throughput is reported at the end.
+"""
+import argparse, csv, json, os, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.datastructures import FileStorage
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+QUOTE_EXTENSIONS = ('.pdf', '.csv')
+SUMMARY_FIELDS = ['file', 'line_items', 'parts', 'missing_slots', 'incomplete_parts',
+                  'invalid_networks', 'warnings', 'seconds', 'error']
+app = None
+
+def load_app():
+    """
+    Import the app, which loads the catalog. Its spreadsheet paths are relative
+    to the repo, and it wants a session folder even though none is used here.
+    """
+    global app
+    if app is None:
+        os.chdir(REPO_DIR)
+        os.environ.setdefault("RAILWAY_VOLUME_PATH", os.path.join(tempfile.gettempdir(), "jbam_sessions"))
+        # No requests will load prebuilts, so skip pre-solving them
+        os.environ.setdefault("WARM_PREBUILTS", "0")
+        import app
+
+def find_quotes(folder):
+    """Every quote file under folder, sorted."""
+    quotes = []
+    for root, _, files in os.walk(folder):
+        quotes += [os.path.join(root, f) for f in files if f.lower().endswith(QUOTE_EXTENSIONS)]
+    return sorted(quotes)
+
+def start_worker():
+    load_app()
+    # Quotes are already spread over processes, so each one reads its PDF alone
+    app.PDF_WORKERS = 1
+
+def validate_quote(path):
+    """Solve one quote file and summarize what is wrong with it."""
+    started = time.perf_counter()
+    summary = dict.fromkeys(SUMMARY_FIELDS, '')
+    summary['file'] = path
+    try:
+        with open(path, 'rb') as f:
+            rows = app.read_quote_file(FileStorage(f, filename=os.path.basename(path)))
+        quote = {'quote_list': [], 'active_status': {}, 'next_uid': 1, 'custom_slots': []}
+        quote['quote_list'] = app.quote_line_items(quote, rows)
+        state = app.QuoteState()
+        app.update_graph(state, quote)
+        empty_slots, _, _, verbose_error = app.check_slots(state.network)
+        invalid = [f'{tag} not valid' for tag in app.CHECK_TAGS]
+        summary.update(
+            line_items=len(quote['quote_list']),
+            parts=len(state.network),
+            missing_slots=empty_slots,
+            incomplete_parts=[e.strip() for e in verbose_error],
+            invalid_networks=[w.split()[0] for w in state.warnings if w in invalid],
+            warnings=[w for w in state.warnings if w not in invalid],
+        )
+    except Exception as e:
+        summary['error'] = f'{type(e).__name__}: {e}'
+    summary['seconds'] = round(time.perf_counter() - started, 4)
+    return summary
+
+def write_summaries(summaries, output):
+    """Write the summary rows as JSONL or CSV, depending on the file name."""
+    with open(output, 'w', newline='') as f:
+        if output.lower().endswith('.jsonl'):
+            for summary in summaries:
+                f.write(json.dumps(summary) + '\n')
+            return
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow({k: '; '.join(v) if isinstance(v, list) else v for k, v in summary.items()})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate every quote PDF/CSV in a folder.")
+    parser.add_argument('folder', help="folder searched recursively for .pdf and .csv quotes")
+    parser.add_argument('-o', '--output', default='quote_summary.csv', help="summary file, .csv or .jsonl")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="worker processes")
+    args = parser.parse_args(argv)
+
+    quotes = find_quotes(os.path.abspath(args.folder))
+    if not quotes:
+        parser.error(f"no quotes found in {args.folder}")
+    output = os.path.abspath(args.output)
+    load_app()
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=start_worker) as pool:
+        summaries = list(pool.map(validate_quote, quotes, chunksize=max(1, len(quotes) // (4 * args.jobs))))
+    elapsed = time.perf_counter() - started
+    write_summaries(summaries, output)
+
+    failed = sum(1 for s in summaries if s['error'])
+    flagged = sum(1 for s in summaries if not s['error'] and (s['missing_slots'] or s['invalid_networks'] or s['warnings']))
+    print(f"Validated {len(quotes)} quotes in {elapsed:.1f}s ({len(quotes) / elapsed:.1f} quotes/s) "
+          f"with {args.jobs} workers: {flagged} with problems, {failed} unreadable. "
+          f"Summary written to {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()